@@ -4,16 +4,21 @@ import torch.nn as nn
 import torch.nn.functional as F
 from PIL import Image
 from torchvision import transforms
-from skimage.color import rgb2gray
-from skimage.feature import graycomatrix, graycoprops
 from torchvision.models import resnet18, ResNet18_Weights
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 import base64
+import io
 import logging
 import time
+import hashlib
+import hmac
+import json
+import threading
+import urllib.error
+import urllib.request
 from functools import wraps
 from ultralytics import YOLO
 
@@ -23,6 +28,9 @@ warnings.simplefilter('ignore')
 import torch
 import cv2
 from ultralytics.nn.tasks import DetectionModel
+from feature_index import FeatureIndex
+from history_store import HistoryStore
+from image_features import ALLOWED_EXTENSIONS, GLCMFeatureExtractor, allowed_file
 
 def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
     # Resize and pad image while meeting stride-multiple constraints
@@ -155,6 +163,28 @@ classification = []
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SCALER_PATH = os.path.join(BASE_DIR, 'minmax_scaler.pkl')
 MODEL_PATH = os.path.join(BASE_DIR, 'ann_model_state_dict.pth')
+YOLO_PATH = os.getenv('YOLO_PATH', 'best.pt')
+
+# Scan history configuration
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', os.path.join(BASE_DIR, 'history.db'))
+
+# Supabase Auth, used to verify access tokens on per-user endpoints
+SUPABASE_URL = os.getenv('SUPABASE_URL', os.getenv('NEXT_PUBLIC_SUPABASE_URL'))
+SUPABASE_ANON_KEY = os.getenv('SUPABASE_ANON_KEY', os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY'))
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', 60))  # seconds a verified token is trusted
+
+# Model hot-swap configuration
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+GOLDEN_DIR = os.getenv('GOLDEN_DIR', os.path.join(BASE_DIR, 'golden'))
+GOLDEN_MIN_ACCURACY = float(os.getenv('GOLDEN_MIN_ACCURACY', 0.9))
+# Allow swapping in models with no labelled golden images to check them against
+GOLDEN_OPTIONAL = os.getenv('GOLDEN_OPTIONAL', 'False').lower() == 'true'
+MODEL_WATCH_INTERVAL = float(os.getenv('MODEL_WATCH_INTERVAL', 0))  # seconds, 0 disables
+
+# Similar-scan index configuration
+FEATURE_INDEX_DIR = os.getenv('FEATURE_INDEX_DIR', os.path.join(BASE_DIR, 'feature_index'))
+FEATURE_INDEX_UPLOADS = os.getenv('FEATURE_INDEX_UPLOADS', 'True').lower() == 'true'
+KNN_K = int(os.getenv('KNN_K', 5))
 
 # Upload configuration
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
@@ -162,12 +192,6 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 8 * 1024 * 1024))  # 8MB limit
 
-# Allowed file extensions
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'gif'}
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 # Rate limiting decorator
 def rate_limit(max_requests=60, window=60):
     def decorator(f):
@@ -191,38 +215,68 @@ def rate_limit(max_requests=60, window=60):
         return decorated_function
     return decorator
 
-import os
-import numpy as np
-from PIL import Image
-from skimage.color import rgb2gray
-from skimage.feature import graycomatrix, graycoprops
-
-class GLCMFeatureExtractor:
-    def __init__(self, distances=[50], angles=[np.pi/2], levels=256, props=None):
-        self.distances = distances
-        self.angles = angles
-        self.levels = levels
-        self.props = props or ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation']
-        self.feature_names = [f"{prop.capitalize()}" for prop in self.props]
-
-    def extract_from_image(self, image_path):
-        image = self._load_image(image_path)
-        glcm = graycomatrix(image, 
-                            distances=self.distances,
-                            angles=self.angles,
-                            levels=self.levels)
-        
-        features = {}
-        for prop in self.props:
-            value = graycoprops(glcm, prop)[0, 0]
-            features[prop.capitalize()] = value
-        
-        return features
-
-    def _load_image(self, image_path):
-        im_frame = Image.open(image_path).convert("RGB")
-        gray_image = rgb2gray(np.array(im_frame))
-        return (gray_image * 255).astype(np.uint8)
+AUTH_CACHE = {}
+AUTH_CACHE_LOCK = threading.Lock()
+
+def bearer_token():
+    """Return the bearer token from the Authorization header, or None"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    token = token.strip()
+    return token if scheme.lower() == 'bearer' and token else None
+
+def verify_access_token(token):
+    """Return the email of the Supabase user a token belongs to, or None if the token is invalid"""
+    # Cache by hash so raw tokens are never kept in memory longer than the request
+    key = hashlib.sha256(token.encode()).hexdigest()
+    now = time.time()
+    with AUTH_CACHE_LOCK:
+        cached = AUTH_CACHE.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    auth_request = urllib.request.Request(
+        f"{SUPABASE_URL.rstrip('/')}/auth/v1/user",
+        headers={'Authorization': f'Bearer {token}', 'apikey': SUPABASE_ANON_KEY}
+    )
+    try:
+        with urllib.request.urlopen(auth_request, timeout=10) as response:
+            user = json.load(response)
+    except urllib.error.HTTPError as e:
+        if e.code in (401, 403):
+            return None
+        raise
+
+    email = user.get('email')
+    if not email:
+        return None
+    with AUTH_CACHE_LOCK:
+        for expired in [k for k, (_, expires) in AUTH_CACHE.items() if expires <= now]:
+            del AUTH_CACHE[expired]
+        AUTH_CACHE[key] = (email, now + AUTH_CACHE_TTL)
+    return email
+
+def require_user(f):
+    """Require a valid Supabase access token; the signed-in user's email is put in g.email"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not SUPABASE_URL or not SUPABASE_ANON_KEY:
+            return jsonify({'error': 'Authentication not configured'}), 503
+
+        token = bearer_token()
+        if token is None:
+            return jsonify({'error': 'Authorization bearer token required'}), 401
+
+        try:
+            email = verify_access_token(token)
+        except Exception as e:
+            logger.error(f"Token verification error: {e}")
+            return jsonify({'error': 'Authentication service unavailable'}), 503
+        if email is None:
+            return jsonify({'error': 'Invalid or expired access token'}), 401
+
+        g.email = email
+        return f(*args, **kwargs)
+    return decorated_function
 
 # Use the extractor
 def classify_contamination(img_path):
@@ -327,43 +381,74 @@ def extract_deep_features(image_path):
         features = model(img_tensor).cpu().squeeze(0).numpy()
     return features
 
+def extract_deep_features_batch(images):
+    """Extract deep features for a list of PIL images in a single forward pass"""
+    img_tensor = torch.stack([transform(image) for image in images]).to(device)
+    with torch.no_grad():
+        features = model(img_tensor).cpu().numpy()
+    return features
+
 class ANN(nn.Module):
-    def __init__(self):
+    def __init__(self, input_size=517, hidden1=256, hidden2=128, num_classes=3, dropout=0.3):
         super(ANN, self).__init__()
-        self.fc1 = nn.Linear(517, 256)
+        self.fc1 = nn.Linear(input_size, hidden1)
         self.relu1 = nn.ReLU()
-        self.dropout1 = nn.Dropout(0.3)
-        self.fc2 = nn.Linear(256, 128)
+        self.dropout1 = nn.Dropout(dropout)
+        self.fc2 = nn.Linear(hidden1, hidden2)
         self.relu2 = nn.ReLU()
-        self.dropout2 = nn.Dropout(0.3)
-        self.output = nn.Linear(128, 3)  # adjust to 2 for binary, more for multiclass
+        self.dropout2 = nn.Dropout(dropout)
+        self.output = nn.Linear(hidden2, num_classes)  # adjust to 2 for binary, more for multiclass
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        """Build an ANN sized to match a saved state dict, e.g. one from a hyperparameter sweep"""
+        ann_model = cls(
+            input_size=state_dict['fc1.weight'].shape[1],
+            hidden1=state_dict['fc1.weight'].shape[0],
+            hidden2=state_dict['fc2.weight'].shape[0],
+            num_classes=state_dict['output.weight'].shape[0]
+        )
+        ann_model.load_state_dict(state_dict)
+        return ann_model
 
     def forward(self, x):
         x = self.dropout1(self.relu1(self.fc1(x)))
         x = self.dropout2(self.relu2(self.fc2(x)))
         return self.output(x)
     
-# Global model variables for caching
-SCALER = None
-ANN_MODEL = None
-YOLO_MODEL = None
-HEATMAP_GENERATOR = None
+class ModelSet:
+    """A complete set of loaded models; requests keep a reference to one for their whole lifetime"""
+    def __init__(self, scaler, ann_model, yolo_model, heatmap_generator, version):
+        self.scaler = scaler
+        self.ann_model = ann_model
+        self.yolo_model = yolo_model
+        self.heatmap_generator = heatmap_generator
+        self.version = version
 
-def load_models():
-    """Load models at startup for better performance"""
-    global SCALER, ANN_MODEL, YOLO_MODEL, HEATMAP_GENERATOR
-    
+
+def model_version(paths):
+    """Short content hash of the model files, so identical files report the same version"""
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def build_model_set(include_heatmap=True):
+    """Load a model set from disk without touching the one currently being served"""
     try:
-        SCALER = joblib.load(SCALER_PATH)
+        scaler = joblib.load(SCALER_PATH)
         logger.info(f"Loaded scaler from {SCALER_PATH}")
     except Exception as e:
         logger.error(f"Failed to load scaler: {e}")
         raise
     
     try:
-        ANN_MODEL = ANN()
-        ANN_MODEL.load_state_dict(torch.load(MODEL_PATH, map_location=device))
-        ANN_MODEL.eval()
+        ann_model = ANN.from_state_dict(torch.load(MODEL_PATH, map_location=device))
+        ann_model.eval()
         logger.info(f"Loaded ANN model from {MODEL_PATH}")
     except Exception as e:
         logger.error(f"Failed to load ANN model: {e}")
@@ -371,35 +456,235 @@ def load_models():
 
     try:
         logger.info("Attempting to load YOLO model...")
-        YOLO_MODEL = YOLO("best.pt")
-        logger.info(f"Successfully loaded YOLO model from best.pt")
+        yolo_model = YOLO(YOLO_PATH)
+        logger.info(f"Successfully loaded YOLO model from {YOLO_PATH}")
         # Test the model with a simple prediction to ensure it's working
         logger.info("YOLO model loaded and ready")
     except Exception as e:
         logger.error(f"Failed to load YOLO model: {e}")
         logger.error(f"Error type: {type(e).__name__}")
         # Don't raise exception, just log the error and continue without YOLO
-        YOLO_MODEL = None
+        yolo_model = None
+
+    heatmap_generator = None
+    if include_heatmap:
+        try:
+            logger.info("Attempting to load heatmap generator...")
+            heatmap_generator = yolov8_heatmap(YOLO_PATH, method="EigenCAM", show_box=False)
+            logger.info("Successfully loaded heatmap generator")
+        except Exception as e:
+            logger.error(f"Failed to load heatmap generator: {e}")
+            logger.error(f"Error type: {type(e).__name__}")
+            # Don't raise exception, just log the error and continue without heatmap generator
+            heatmap_generator = None
+
+    version = model_version([SCALER_PATH, MODEL_PATH, YOLO_PATH])
+    return ModelSet(scaler, ann_model, yolo_model, heatmap_generator, version)
+
+
+# Global model variables for caching. MODELS is only ever replaced as a whole,
+# so a request that grabbed the old set keeps using it until it finishes.
+MODELS = None
+FEATURE_INDEX = None
+HISTORY_STORE = None
+RELOAD_LOCK = threading.Lock()
+RELOAD_STATUS = {'state': 'idle', 'error': None, 'finished': None}
+
+def load_models():
+    """Load models at startup for better performance"""
+    global MODELS, FEATURE_INDEX
+    
+    MODELS = build_model_set()
+    logger.info(f"Serving model version {MODELS.version}")
+
+    # The debug reloader's parent process only watches files; leave the index (and its
+    # single-process lock) to the child that serves requests
+    if os.getenv('FLASK_DEBUG', 'False').lower() == 'true' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
 
     try:
-        logger.info("Attempting to load heatmap generator...")
-        HEATMAP_GENERATOR = yolov8_heatmap("best.pt", method="EigenCAM", show_box=False)
-        logger.info("Successfully loaded heatmap generator")
+        FEATURE_INDEX = FeatureIndex(FEATURE_INDEX_DIR)
+        logger.info(f"Loaded feature index from {FEATURE_INDEX_DIR} ({len(FEATURE_INDEX)} scans)")
     except Exception as e:
-        logger.error(f"Failed to load heatmap generator: {e}")
-        logger.error(f"Error type: {type(e).__name__}")
-        # Don't raise exception, just log the error and continue without heatmap generator
-        HEATMAP_GENERATOR = None
+        logger.error(f"Failed to load feature index: {e}")
+        # Similar-scan lookup is optional, continue without it
+        FEATURE_INDEX = None
+        return
+
+    start_index_rebuild()
 
 
-def detect(img_path):
+def rebuild_feature_index():
+    """Re-cluster the feature index; searches and uploads keep running meanwhile"""
+    index = FEATURE_INDEX
+    start = time.time()
+    try:
+        if index.build_ivf(blocking=False):
+            logger.info(f"Rebuilt feature index clustering over {len(index)} scans in {time.time() - start:.1f}s")
+    except Exception as e:
+        logger.error(f"Feature index rebuild failed: {e}")
+
+
+def start_index_rebuild():
+    """Start rebuild_feature_index in the background once enough scans are unclustered"""
+    if FEATURE_INDEX is None or not FEATURE_INDEX.needs_rebuild():
+        return False
+    threading.Thread(target=rebuild_feature_index, daemon=True).start()
+    return True
+
+
+def load_history_store():
+    """Open the scan history database"""
+    global HISTORY_STORE
+
+    try:
+        HISTORY_STORE = HistoryStore(HISTORY_DB_PATH)
+        logger.info(f"Opened scan history at {HISTORY_DB_PATH}")
+    except Exception as e:
+        logger.error(f"Failed to open scan history: {e}")
+        # History is optional, continue without it
+        HISTORY_STORE = None
+
+
+def golden_images():
+    """List (path, label) pairs from GOLDEN_DIR; images in 0/1/2 subfolders are labelled"""
+    if not os.path.isdir(GOLDEN_DIR):
+        return []
+
+    images = []
+    for name in sorted(os.listdir(GOLDEN_DIR)):
+        path = os.path.join(GOLDEN_DIR, name)
+        if os.path.isdir(path) and name.isdigit():
+            images.extend((os.path.join(path, f), int(name)) for f in sorted(os.listdir(path)) if allowed_file(f))
+        elif allowed_file(name):
+            images.append((path, None))
+    return images
+
+
+def verify_model_set(models):
+    """Warm a candidate model set on the golden images and check its accuracy
+
+    Golden images all show a bag, so one only counts as correct when the bag is
+    detected and, if labelled, classified as its label.
+    """
+    images = golden_images()
+    if not any(label is not None for _, label in images):
+        if not GOLDEN_OPTIONAL:
+            raise ValueError(f"No labelled golden images in {GOLDEN_DIR}; "
+                             f"add some or set GOLDEN_OPTIONAL=true to swap without a check")
+        logger.warning(f"No labelled golden images in {GOLDEN_DIR}, skipping the accuracy check")
+    if not images:
+        # Still run one prediction so the swap doesn't pay the warm-up cost
+        images = [(None, None)]
+
+    correct = labelled = 0
+    for path, label in images:
+        processed_path = os.path.join(UPLOAD_FOLDER, f"golden_{threading.get_ident()}.png")
+        try:
+            if path is None:
+                Image.new("RGB", (224, 224), (128, 128, 128)).save(processed_path)
+            else:
+                # Same preprocessing as /api/upload
+                Image.open(path).convert("RGB").resize((224, 224)).save(processed_path)
+            has_bag = detect(processed_path, models)
+            predicted_class, _, _ = classify_with_features(processed_path, models)
+        finally:
+            try:
+                os.remove(processed_path)
+            except:
+                pass
+
+        if label is not None:
+            labelled += 1
+            correct += int(has_bag and predicted_class == label)
+
+    if labelled == 0:
+        return None
+    accuracy = correct / labelled
+    if accuracy < GOLDEN_MIN_ACCURACY:
+        raise ValueError(f"Golden set accuracy {accuracy:.3f} is below {GOLDEN_MIN_ACCURACY}")
+    return accuracy
+
+
+def reload_models(blocking=False):
+    """Load, warm and verify a new model set, then swap it in; returns True on success"""
+    global MODELS
+
+    if not RELOAD_LOCK.acquire(blocking=blocking):
+        return False
+
+    try:
+        RELOAD_STATUS.update(state='loading', error=None, started=time.time())
+        candidate = build_model_set()
+
+        # YOLO and the heatmap generator fall back to None on load errors; never lose one in a swap
+        current = MODELS
+        missing = [name for name in ('yolo_model', 'heatmap_generator')
+                   if current is not None and getattr(current, name) is not None
+                   and getattr(candidate, name) is None]
+        if missing:
+            raise ValueError(f"New model set failed to load: {', '.join(missing)}")
+
+        RELOAD_STATUS['state'] = 'verifying'
+        accuracy = verify_model_set(candidate)
+
+        previous = MODELS
+        MODELS = candidate
+        RELOAD_STATUS.update(state='idle', finished=time.time(), accuracy=accuracy,
+                             previous_version=previous.version if previous else None)
+        logger.info(f"Swapped in model version {candidate.version} (golden accuracy: {accuracy})")
+        return True
+    except Exception as e:
+        logger.error(f"Model reload failed, still serving {MODELS.version if MODELS else None}: {e}")
+        RELOAD_STATUS.update(state='failed', error=str(e), finished=time.time())
+        return False
+    finally:
+        RELOAD_LOCK.release()
+
+
+def start_reload():
+    """Run reload_models in a background thread unless a reload is already running"""
+    if RELOAD_LOCK.locked():
+        return False
+    threading.Thread(target=reload_models, daemon=True).start()
+    return True
+
+
+def watch_model_files(interval):
+    """Poll the model files and reload once they have changed and stopped changing"""
+    paths = [SCALER_PATH, MODEL_PATH, YOLO_PATH]
+
+    def snapshot():
+        return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in paths)
+
+    current = snapshot()
+    pending = None
+    while True:
+        time.sleep(interval)
+        latest = snapshot()
+        if latest == current:
+            pending = None
+            continue
+        if latest != pending:
+            # Files may still be mid-copy; wait until they are stable for one interval
+            pending = latest
+            continue
+        pending = None
+        logger.info("Model files changed, reloading")
+        # Wait out a reload already in progress so this change is never dropped
+        reload_models(blocking=True)
+        current = latest
+
+
+def detect(img_path, models=None):
     """Detect if fruiting bag is present in the image"""
-    if YOLO_MODEL is None:
+    models = models or MODELS
+    if models.yolo_model is None:
         logger.warning("YOLO model not loaded, skipping bag detection")
         return True  # Skip detection if YOLO model is not available
     
     try:
-        results = YOLO_MODEL.predict(img_path)
+        results = models.yolo_model.predict(img_path)
         if results and len(results) > 0 and results[0].boxes is not None:
             return any(results[0].names[int(box.cls[0])] == "bag" for box in results[0].boxes)
         return False
@@ -408,8 +693,46 @@ def detect(img_path):
         return True  # Skip detection on error
 
 
-def classify(img_path):
+def detect_batch(images, models=None):
+    """Batched counterpart of detect for a list of PIL images"""
+    models = models or MODELS
+    if models.yolo_model is None:
+        logger.warning("YOLO model not loaded, skipping bag detection")
+        return [True] * len(images)
+
+    try:
+        results = models.yolo_model.predict(images, verbose=False)
+        return [
+            result.boxes is not None and any(result.names[int(box.cls[0])] == "bag" for box in result.boxes)
+            for result in results
+        ]
+    except Exception as e:
+        logger.error(f"YOLO detection error: {e}")
+        return [True] * len(images)
+
+
+def predict_features(features, models=None):
+    """Scale combined GLCM + deep feature rows and run the ANN on them"""
+    models = models or MODELS
+    features_scaled = models.scaler.transform(features)
+    input_tensor = torch.tensor(features_scaled, dtype=torch.float32).to(device)
+
+    with torch.no_grad():
+        logits = models.ann_model(input_tensor)
+        probs = F.softmax(logits, dim=1)
+        confidences, predicted = torch.max(probs, dim=1)
+
+    return predicted.cpu().numpy(), confidences.cpu().numpy()
+
+
+def classify(img_path, models=None):
     """Classify mushroom contamination with error handling"""
+    predicted_class, confidence, _ = classify_with_features(img_path, models)
+    return predicted_class, confidence
+
+
+def classify_with_features(img_path, models=None):
+    """Classify and also return the deep features so they can be indexed"""
     try:
         glcm_features = list(classify_contamination(img_path).values())
         resnet_features = extract_deep_features(img_path)
@@ -418,17 +741,9 @@ def classify(img_path):
             raise ValueError("Failed to extract deep features")
         
         features = np.concatenate((glcm_features, resnet_features), axis=0).reshape(1, -1)
-        features_scaled = SCALER.transform(features)
-        
-        input_tensor = torch.tensor(features_scaled, dtype=torch.float32).to(device)
-        
-        with torch.no_grad():
-            logits = ANN_MODEL(input_tensor)
-            probs = F.softmax(logits, dim=1)
-            predicted_class = torch.argmax(probs, dim=1).item()
-            confidence = torch.max(probs).item()
+        predicted, confidences = predict_features(features, models)
         
-        return predicted_class, confidence
+        return int(predicted[0]), float(confidences[0]), resnet_features
     except Exception as e:
         logger.error(f"Classification error: {e}")
         raise
@@ -437,6 +752,8 @@ def classify(img_path):
 @rate_limit(max_requests=60, window=60)  # 5 requests per minute
 def upload_image():
     """Upload and classify mushroom image with security checks"""
+    # Pin the model set so a hot swap mid-request can't mix versions
+    models = MODELS
     try:
         if 'image' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
@@ -469,8 +786,8 @@ def upload_image():
         img_processed.save(processed_path)
         
         # Classify using processed image
-        if detect(processed_path):
-            _class, _confidence = classify(processed_path)
+        if detect(processed_path, models):
+            _class, _confidence, resnet_features = classify_with_features(processed_path, models)
         else:
             # Clean up uploaded files
             try:
@@ -497,13 +814,46 @@ def upload_image():
         except:
             pass
         
-        # Return result with image
-        return jsonify({
+        response = {
             'result': _class,
             'confidence': round(_confidence, 3),
             'image': img_base64,
+            'model_version': models.version,
             'status': 'success'
-        })
+        }
+
+        if FEATURE_INDEX is not None:
+            try:
+                # Vote before indexing so the scan can't vote for itself
+                if request.values.get('knn', 'false').lower() == 'true':
+                    response['knn'] = FEATURE_INDEX.vote(resnet_features, k=KNN_K)
+                if FEATURE_INDEX_UPLOADS:
+                    # Uploads carry the ANN prediction, not a ground-truth label
+                    FEATURE_INDEX.add(resnet_features, [{
+                        'image': filename,
+                        'predicted': _class,
+                        'confidence': round(_confidence, 3),
+                        'model_version': models.version,
+                        'source': 'upload'
+                    }])
+                    start_index_rebuild()
+            except Exception as e:
+                logger.error(f"Feature index error: {e}")
+
+        # Signed-in uploads are recorded for the user the access token belongs to
+        token = bearer_token()
+        if token and HISTORY_STORE is not None and SUPABASE_URL and SUPABASE_ANON_KEY:
+            try:
+                email = verify_access_token(token)
+                if email:
+                    response['history_id'] = HISTORY_STORE.add(
+                        email, img_bytes, _class, round(_confidence, 3), model_version=models.version
+                    )
+            except Exception as e:
+                logger.error(f"History store error: {e}")
+        
+        # Return result with image
+        return jsonify(response)
         
     except Exception as e:
         logger.error(f"Upload error: {e}")
@@ -513,6 +863,7 @@ def upload_image():
 @rate_limit(max_requests=60, window=60)
 def generate_heatmap():
     """Generate heatmap visualization for an image"""
+    models = MODELS
     try:
         if 'image' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
@@ -525,7 +876,7 @@ def generate_heatmap():
         if not allowed_file(image.filename):
             return jsonify({'error': 'File type not allowed. Use: PNG, JPG, JPEG, BMP, GIF'}), 400
 
-        if HEATMAP_GENERATOR is None:
+        if models.heatmap_generator is None:
             return jsonify({'error': 'Heatmap generator not available'}), 503
 
         # Secure filename
@@ -540,7 +891,7 @@ def generate_heatmap():
         
         try:
             # Generate heatmap
-            heatmap_img = HEATMAP_GENERATOR(image_path)
+            heatmap_img = models.heatmap_generator(image_path)
             
             # Encode heatmap image to base64
             _, buffer = cv2.imencode('.jpg', heatmap_img)
@@ -548,6 +899,7 @@ def generate_heatmap():
             
             return jsonify({
                 'image': img_base64,
+                'model_version': models.version,
                 'status': 'success'
             })
         finally:
@@ -561,19 +913,251 @@ def generate_heatmap():
         logger.error(f"Heatmap generation error: {e}")
         return jsonify({'error': 'Heatmap generation failed'}), 500
 
+def public_neighbor(meta, score):
+    """Neighbour as returned to clients; other users' uploads are reduced to what they matched"""
+    if meta.get('source') == 'upload':
+        return {'source': 'upload', 'predicted': meta.get('predicted'), 'similarity': round(score, 4)}
+    return dict(meta, similarity=round(score, 4))
+
+@app.route('/api/similar', methods=['POST'])
+@rate_limit(max_requests=60, window=60)
+def similar_scans():
+    """Find the most similar past and training-set scans for an image"""
+    try:
+        if 'image' not in request.files:
+            return jsonify({'error': 'No file uploaded'}), 400
+
+        image = request.files['image']
+        
+        if image.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        if not allowed_file(image.filename):
+            return jsonify({'error': 'File type not allowed. Use: PNG, JPG, JPEG, BMP, GIF'}), 400
+
+        if FEATURE_INDEX is None:
+            return jsonify({'error': 'Feature index not available'}), 503
+
+        try:
+            k = min(max(int(request.values.get('k', KNN_K)), 1), 50)
+        except ValueError:
+            return jsonify({'error': 'k must be an integer'}), 400
+
+        # Secure filename
+        filename = secure_filename(image.filename)
+        if not filename:
+            filename = f"similar_{int(time.time())}.jpg"
+        
+        image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        processed_path = os.path.join(app.config['UPLOAD_FOLDER'], f"processed_{filename}")
+        
+        # Save image temporarily
+        image.save(image_path)
+        
+        try:
+            # Match the preprocessing used by /api/upload
+            Image.open(image_path).convert("RGB").resize((224, 224)).save(processed_path)
+            resnet_features = extract_deep_features(processed_path)
+            if resnet_features is None:
+                raise ValueError("Failed to extract deep features")
+
+            neighbors = [
+                public_neighbor(meta, score)
+                for score, meta in FEATURE_INDEX.search(resnet_features, k=k)
+            ]
+            return jsonify({
+                'neighbors': neighbors,
+                'status': 'success'
+            })
+        finally:
+            # Clean up uploaded files
+            for path in (image_path, processed_path):
+                try:
+                    os.remove(path)
+                except:
+                    pass
+        
+    except Exception as e:
+        logger.error(f"Similar scan lookup error: {e}")
+        return jsonify({'error': 'Similar scan lookup failed'}), 500
+
+@app.route('/api/history', methods=['GET'])
+@rate_limit(max_requests=120, window=60)
+@require_user
+def list_history():
+    """List a user's scans newest first, one cursor-paginated page of thumbnails at a time"""
+    try:
+        if HISTORY_STORE is None:
+            return jsonify({'error': 'Scan history not available'}), 503
+
+        email = g.email
+
+        try:
+            detected_disease = request.args.get('detected_disease')
+            filters = {
+                'detected_disease': int(detected_disease) if detected_disease is not None else None,
+                'since': request.args.get('since')
+            }
+            items, next_cursor = HISTORY_STORE.list(
+                email,
+                limit=request.args.get('limit', 25),
+                cursor=request.args.get('cursor'),
+                include_thumbnails=request.args.get('thumbnails', 'true').lower() == 'true',
+                **filters
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        response = {
+            'items': items,
+            'next_cursor': next_cursor,
+            'status': 'success'
+        }
+        # Totals only change between sessions; send them with the first page
+        if not request.args.get('cursor'):
+            response['total'] = HISTORY_STORE.count(email, **filters)
+        return jsonify(response)
+
+    except Exception as e:
+        logger.error(f"History list error: {e}")
+        return jsonify({'error': 'Failed to load history'}), 500
+
+@app.route('/api/history', methods=['POST'])
+@rate_limit(max_requests=60, window=60)
+@require_user
+def add_history():
+    """Record a scan that was classified elsewhere (e.g. synced from offline mode)"""
+    try:
+        if HISTORY_STORE is None:
+            return jsonify({'error': 'Scan history not available'}), 503
+
+        email = g.email
+
+        if 'image' not in request.files:
+            return jsonify({'error': 'No file uploaded'}), 400
+
+        image = request.files['image']
+        
+        if image.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        if not allowed_file(image.filename):
+            return jsonify({'error': 'File type not allowed. Use: PNG, JPG, JPEG, BMP, GIF'}), 400
+
+        try:
+            detected_disease = request.values.get('detected_disease')
+            confidence = request.values.get('confidence')
+            scan_id = HISTORY_STORE.add(
+                email,
+                image.read(),
+                int(detected_disease) if detected_disease is not None else None,
+                float(confidence) if confidence is not None else None,
+                date_logged=request.values.get('date_logged')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return jsonify({
+            'id': scan_id,
+            'status': 'success'
+        }), 201
+
+    except Exception as e:
+        logger.error(f"History add error: {e}")
+        return jsonify({'error': 'Failed to save scan'}), 500
+
+@app.route('/api/history', methods=['DELETE'])
+@rate_limit(max_requests=60, window=60)
+@require_user
+def delete_history():
+    """Bulk delete a user's scans by id"""
+    try:
+        if HISTORY_STORE is None:
+            return jsonify({'error': 'Scan history not available'}), 503
+
+        payload = request.get_json(silent=True) or {}
+        ids = payload.get('ids')
+        if not isinstance(ids, list):
+            return jsonify({'error': 'a list of ids is required'}), 400
+
+        try:
+            deleted = HISTORY_STORE.delete(g.email, ids)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'ids must be integers'}), 400
+
+        return jsonify({
+            'deleted': deleted,
+            'status': 'success'
+        })
+
+    except Exception as e:
+        logger.error(f"History delete error: {e}")
+        return jsonify({'error': 'Failed to delete scans'}), 500
+
+@app.route('/api/history/<int:scan_id>/image', methods=['GET'])
+@rate_limit(max_requests=120, window=60)
+@require_user
+def history_image(scan_id):
+    """Serve the full-size image of one scan"""
+    try:
+        if HISTORY_STORE is None:
+            return jsonify({'error': 'Scan history not available'}), 503
+
+        found = HISTORY_STORE.get_image(g.email, scan_id)
+        if found is None:
+            return jsonify({'error': 'Scan not found'}), 404
+
+        data, mime = found
+        response = send_file(io.BytesIO(data), mimetype=mime)
+        # Scan images never change, so the browser can keep them
+        response.cache_control.private = True
+        response.cache_control.max_age = 86400
+        return response
+
+    except Exception as e:
+        logger.error(f"History image error: {e}")
+        return jsonify({'error': 'Failed to load image'}), 500
+
+@app.route('/api/admin/reload', methods=['GET', 'POST'])
+@rate_limit(max_requests=10, window=60)
+def admin_reload():
+    """Trigger a background model reload (POST) or report the last one (GET)"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Model reload is disabled'}), 403
+
+    # Compare bytes: compare_digest rejects non-ASCII str with a TypeError
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    current_version = MODELS.version if MODELS is not None else None
+    if request.method == 'GET':
+        return jsonify({
+            'model_version': current_version,
+            'reload': RELOAD_STATUS
+        })
+
+    if not start_reload():
+        return jsonify({'error': 'Reload already in progress'}), 409
+
+    return jsonify({
+        'status': 'reloading',
+        'model_version': current_version
+    }), 202
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for monitoring"""
+    models = MODELS
     try:
         # Check if models are loaded
-        if SCALER is None or ANN_MODEL is None:
+        if models is None:
             return jsonify({
                 'status': 'unhealthy',
                 'message': 'Core models not loaded'
             }), 503
         
         # Check YOLO model status
-        yolo_status = "loaded" if YOLO_MODEL is not None else "not loaded"
+        yolo_status = "loaded" if models.yolo_model is not None else "not loaded"
         
         return jsonify({
             'status': 'healthy',
@@ -583,7 +1167,10 @@ def health_check():
                 'scaler': 'loaded',
                 'ann_model': 'loaded',
                 'yolo_model': yolo_status
-            }
+            },
+            'model_version': models.version,
+            'reload': RELOAD_STATUS['state'],
+            'feature_index': len(FEATURE_INDEX) if FEATURE_INDEX is not None else None
         })
     except Exception as e:
         return jsonify({
@@ -599,6 +1186,8 @@ def home():
         'version': '1.0.0',
         'endpoints': {
             'upload': '/api/upload',
+            'similar': '/api/similar',
+            'history': '/api/history',
             'health': '/health'
         },
         'domain': 'reliably-one-kiwi.ngrok-free.app'
@@ -613,6 +1202,13 @@ if __name__ == '__main__':
         logger.error(f"Failed to load models: {e}")
         exit(1)
     
+    load_history_store()
+    
+    # Reload automatically when retrained model files are dropped in place
+    if MODEL_WATCH_INTERVAL > 0:
+        threading.Thread(target=watch_model_files, args=(MODEL_WATCH_INTERVAL,), daemon=True).start()
+        logger.info(f"Watching model files every {MODEL_WATCH_INTERVAL}s")
+    
     # Production configuration
     debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     port = int(os.getenv('PORT', 5000))
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Offline batch scorer for Shroomify
+
+Scores a whole directory or tar archive of fruiting bag images in-process,
+without going through the web server:
+
+    python batch_score.py /data/camera/2026-10-19 -o results.csv
+    python batch_score.py images.tar.gz -o results.parquet --batch-size 64
+
+Decoding and GLCM extraction run in a pool of worker processes, bag detection
+and CNN inference run batched in the main process, and results are appended to
+CSV or Parquet as each batch finishes. Images already scored in the output are
+skipped, so a killed run picks up where it stopped when re-run with the same
+arguments; images that failed to decode are retried, and the earlier error
+row is dropped once the run finishes so each image keeps a single result.
+"""
+import argparse
+import csv
+import io
+import logging
+import os
+import sys
+import tarfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Worker processes only need these; app (and its CNN) is imported by run() in the main process
+from image_features import GLCMFeatureExtractor, allowed_file
+
+RESULT_FIELDS = ['image', 'result', 'confidence', 'status', 'error']
+
+# Final outcomes; 'error' rows (e.g. a file still being copied) are retried on resume
+DONE_STATUSES = {'success', 'no_bag'}
+
+_EXTRACTOR = GLCMFeatureExtractor()
+
+logger = logging.getLogger('batch_score')
+
+
+def iter_directory(root):
+    """Yield (key, path) for every allowed image below root, in a stable order"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not allowed_file(filename):
+                continue
+            path = os.path.join(dirpath, filename)
+            key = os.path.relpath(path, root).replace(os.sep, '/')
+            yield key, path
+
+
+def iter_tar(archive):
+    """Yield (key, bytes) for every allowed image in a (possibly compressed) tar archive"""
+    with tarfile.open(archive, 'r|*') as tar:
+        for member in tar:
+            if not member.isfile() or not allowed_file(member.name):
+                continue
+            f = tar.extractfile(member)
+            if f is None:
+                continue
+            yield member.name, f.read()
+
+
+def iter_source(source):
+    """Yield (key, path or bytes) pairs; workers read directory files themselves"""
+    if os.path.isdir(source):
+        yield from iter_directory(source)
+    elif tarfile.is_tarfile(source):
+        yield from iter_tar(source)
+    else:
+        raise ValueError(f"Source must be a directory or tar archive: {source}")
+
+
+def preprocess(key, data):
+    """Decode, resize and extract GLCM features for one image (runs in a worker process)
+
+    Mirrors the /api/upload flow: the image is resized to 224x224 and re-encoded
+    in its original format before features are computed, so offline scores match
+    the ones the API would return for the same file.
+    """
+    try:
+        if isinstance(data, bytes):
+            data = io.BytesIO(data)
+        image = Image.open(data).convert("RGB").resize((224, 224))
+        ext = '.' + key.rsplit('.', 1)[1].lower()
+        buffer = io.BytesIO()
+        image.save(buffer, format=Image.registered_extensions()[ext])
+
+        buffer.seek(0)
+        glcm = list(_EXTRACTOR.extract_from_image(buffer).values())
+        buffer.seek(0)
+        pixels = np.array(Image.open(buffer).convert("RGB"))
+        return {'key': key, 'pixels': pixels, 'glcm': glcm, 'error': None}
+    except Exception as e:
+        return {'key': key, 'pixels': None, 'glcm': None, 'error': f"{type(e).__name__}: {e}"}
+
+
+def score_batch(items, models):
+    """Run bag detection, deep feature extraction and the ANN on preprocessed items"""
+    import app
+
+    rows = {}
+    decoded = []
+    for item in items:
+        if item['error'] is not None:
+            rows[item['key']] = {'image': item['key'], 'result': '', 'confidence': '',
+                                 'status': 'error', 'error': item['error']}
+        else:
+            decoded.append(item)
+
+    if decoded:
+        images = [Image.fromarray(item['pixels']) for item in decoded]
+        has_bag = app.detect_batch(images, models)
+
+        bagged = [i for i, ok in enumerate(has_bag) if ok]
+        for i, ok in enumerate(has_bag):
+            if not ok:
+                key = decoded[i]['key']
+                rows[key] = {'image': key, 'result': '', 'confidence': '',
+                             'status': 'no_bag', 'error': 'No fruiting bag detected in the image'}
+
+        if bagged:
+            deep = app.extract_deep_features_batch([images[i] for i in bagged])
+            glcm = np.array([decoded[i]['glcm'] for i in bagged])
+            features = np.concatenate((glcm, deep), axis=1)
+            predicted, confidences = app.predict_features(features, models)
+            for i, _class, _confidence in zip(bagged, predicted, confidences):
+                key = decoded[i]['key']
+                rows[key] = {'image': key, 'result': int(_class),
+                             'confidence': round(float(_confidence), 3),
+                             'status': 'success', 'error': ''}
+
+    return [rows[item['key']] for item in items]
+
+
+class CSVWriter:
+    """Appends result rows to a CSV file, flushing after every batch"""
+
+    def __init__(self, path):
+        self.path = path
+        self._repair()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS)
+        if is_new:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def _repair(self):
+        # A killed run can leave a half-written last line; drop it so appends stay aligned
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def completed(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, newline='', encoding='utf-8') as f:
+            return {row['image'] for row in csv.DictReader(f) if row.get('status') in DONE_STATUSES}
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+        self._dedupe()
+
+    def _dedupe(self):
+        # A retried image has its old error row followed by the new result; keep only the newest
+        with open(self.path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        latest = {row['image']: i for i, row in enumerate(rows)}
+        if len(latest) == len(rows):
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(row for i, row in enumerate(rows) if latest[row['image']] == i)
+        os.replace(tmp_path, self.path)
+
+
+class ParquetWriter:
+    """Writes each batch as a separate part file inside the output directory"""
+
+    def __init__(self, path):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise RuntimeError("Parquet output requires pandas and pyarrow: pip install pandas pyarrow")
+        self.pd = pd
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.parts = sorted(name for name in os.listdir(path) if name.endswith('.parquet'))
+        self.errored = {}
+        self.written = set()
+
+    def completed(self):
+        done = set()
+        for name in self.parts:
+            frame = self.pd.read_parquet(os.path.join(self.path, name), columns=['image', 'status'])
+            done.update(frame.loc[frame['status'].isin(DONE_STATUSES), 'image'])
+            for image in frame.loc[~frame['status'].isin(DONE_STATUSES), 'image']:
+                self.errored.setdefault(image, set()).add(name)
+        return done
+
+    def write(self, rows):
+        frame = self.pd.DataFrame(rows, columns=RESULT_FIELDS)
+        frame['result'] = self.pd.to_numeric(frame['result'], errors='coerce').astype('Int64')
+        frame['confidence'] = self.pd.to_numeric(frame['confidence'], errors='coerce')
+        name = f"part-{len(self.parts):06d}.parquet"
+        tmp_path = os.path.join(self.path, f".{name}.tmp")
+        # Write then rename so a killed run never leaves a truncated part behind
+        frame.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(self.path, name))
+        self.parts.append(name)
+        self.written.update(frame['image'])
+
+    def close(self):
+        # Drop the stale error rows of images that were retried in this run
+        stale_parts = set()
+        for image in self.written & self.errored.keys():
+            stale_parts |= self.errored[image]
+        for name in sorted(stale_parts):
+            part_path = os.path.join(self.path, name)
+            frame = self.pd.read_parquet(part_path)
+            frame = frame[~(frame['image'].isin(self.written) & ~frame['status'].isin(DONE_STATUSES))]
+            tmp_path = os.path.join(self.path, f".{name}.tmp")
+            frame.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, part_path)
+
+
+def run(source, output, output_format='csv', batch_size=32, workers=None, log_every=500):
+    """Score every image in source and append the results to output"""
+    writer = ParquetWriter(output) if output_format == 'parquet' else CSVWriter(output)
+    done = writer.completed()
+    if done:
+        logger.info(f"Resuming: {len(done)} images already scored in {output}")
+
+    # Only what scoring needs: no heatmap generator, no similar-scan index
+    from app import build_model_set
+    models = build_model_set(include_heatmap=False)
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max(batch_size, workers) * 2
+    scored = 0
+    start = time.time()
+    last_log = 0
+
+    def flush(batch):
+        nonlocal scored, last_log
+        writer.write(score_batch(batch, models))
+        scored += len(batch)
+        if scored - last_log >= log_every:
+            last_log = scored
+            elapsed = time.time() - start
+            logger.info(f"Scored {scored} images ({scored / elapsed:.1f} images/sec)")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = deque()
+            batch = []
+            for key, data in iter_source(source):
+                if key in done:
+                    continue
+                in_flight.append(pool.submit(preprocess, key, data))
+                # Bound the number of decoded images held in memory at once
+                while len(in_flight) >= max_in_flight:
+                    batch.append(in_flight.popleft().result())
+                    if len(batch) >= batch_size:
+                        flush(batch)
+                        batch = []
+            while in_flight:
+                batch.append(in_flight.popleft().result())
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+    finally:
+        writer.close()
+
+    elapsed = time.time() - start
+    rate = scored / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Finished: scored {scored} images in {elapsed:.1f}s ({rate:.1f} images/sec)")
+    return scored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a directory or tar archive of images offline")
+    parser.add_argument('source', help="Image directory or tar archive (.tar, .tar.gz, ...)")
+    parser.add_argument('-o', '--output', required=True,
+                        help="Output CSV file, or Parquet directory when --format parquet")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=None,
+                        help="Output format (default: inferred from the output extension)")
+    parser.add_argument('--batch-size', type=int, default=32, help="Images per CNN/ANN batch (default: 32)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Decode/GLCM worker processes (default: CPU count)")
+    parser.add_argument('--log-every', type=int, default=500,
+                        help="Report throughput every N images (default: 500)")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    try:
+        run(args.source, args.output, output_format, args.batch_size, args.workers, args.log_every)
+    except KeyboardInterrupt:
+        logger.info("Interrupted; re-run the same command to resume")
+        return 130
+    except Exception as e:
+        logger.error(f"Batch scoring failed: {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
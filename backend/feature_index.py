@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+On-disk nearest-neighbour index over ResNet18-CBAM deep features
+
+Vectors are L2-normalised and stored as int8 (or float16) rows in a
+memory-mapped file, so similarity is a dot product and the index never has to
+be loaded into RAM. int8 rows carry their own float32 scale, since post-ReLU
+features are small and non-negative and one fixed scale would leave them only
+a few bits of precision. Search is a vectorised brute-force scan until
+build_ivf() is run; that clusters the rows and rewrites them grouped by
+cluster, so each query only scans the n_probe closest lists as contiguous
+slices plus whatever was appended since the last build. A build writes a new
+generation of files next to the live one and switches to it under the lock,
+so the API keeps serving (and re-clusters in the background once enough rows
+are unclustered).
+
+Only one process may open an index at a time; the API holds it while running,
+so stop the API before importing or building from the command line:
+
+    python feature_index.py import "../model training/dataset.csv"
+    python feature_index.py build-ivf
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_DIM = 512
+INITIAL_CAPACITY = 1024
+INT8_MAX = 127.0
+SEARCH_CHUNK = 16384
+# Below this size a brute-force scan stays in the low milliseconds
+IVF_MIN_ROWS = 5000
+MAX_UNCLUSTERED = 0.1
+# Files rewritten by each build; index.json names the live generation
+GENERATION_FILES = ('vectors.bin', 'lists.bin', 'scales.bin', 'meta.jsonl', 'ivf.npz')
+
+
+class FeatureIndex:
+    def __init__(self, path, dim=DEFAULT_DIM, dtype='int8'):
+        self.path = path
+        self.lock = threading.Lock()
+        # Searches score outside the lock; remapping waits until none hold the old maps
+        self.readers_done = threading.Condition(self.lock)
+        self.readers = 0
+        self.build_lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.lock_file = self._lock_directory()
+
+        info_path = os.path.join(path, 'index.json')
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                info = json.load(f)
+        else:
+            info = {'dim': dim, 'dtype': dtype, 'count': 0, 'capacity': INITIAL_CAPACITY,
+                    'next_id': 0, 'clustered': 0, 'generation': 0, 'scaled': True}
+
+        if info['dtype'] not in ('float16', 'int8'):
+            raise ValueError(f"Unsupported index dtype: {info['dtype']}")
+
+        self.dim = info['dim']
+        self.dtype = np.dtype(info['dtype'])
+        self.capacity = info['capacity']
+        self.next_id = info['next_id']
+        self.clustered = info['clustered']
+        self.generation = info.get('generation', 0)
+        self._remove_stale_generations()
+
+        # Metadata lines past the recorded count belong to an interrupted append
+        self.metadata = []
+        meta_path = self._file('meta.jsonl')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                for line in f:
+                    if len(self.metadata) == info['count']:
+                        self._write_metadata(self.metadata, meta_path)
+                        break
+                    self.metadata.append(json.loads(line))
+        self.count = len(self.metadata)
+
+        self.vectors, self.lists, self.scales = self._map_rows(self.capacity)
+        if self.scales is not None and not info.get('scaled'):
+            # Indexes written before per-row scales used one fixed scale for every row
+            self.scales[:self.count] = 1.0 / INT8_MAX
+            self.scales.flush()
+
+        self.centroids = None
+        self.offsets = None
+        ivf_path = self._file('ivf.npz')
+        if os.path.exists(ivf_path):
+            with np.load(ivf_path) as ivf:
+                self.centroids = ivf['centroids']
+                self.offsets = ivf['offsets']
+
+        self._save_info()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Flush the index and release it for other processes"""
+        with self.lock:
+            self.vectors.flush()
+            self.lists.flush()
+            if self.scales is not None:
+                self.scales.flush()
+            self.lock_file.close()
+
+    def _lock_directory(self):
+        # Each process keeps count and metadata in memory, so a second writer would silently
+        # overwrite the first one's rows; refuse to open an index another process holds
+        lock_file = open(os.path.join(self.path, 'index.lock'), 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(f"Feature index {self.path} is in use by another process (stop the API first)")
+        return lock_file
+
+    def _file(self, name, generation=None):
+        # Generation 0 keeps the original file names so existing indexes still open
+        generation = self.generation if generation is None else generation
+        if generation == 0:
+            return os.path.join(self.path, name)
+        base, ext = os.path.splitext(name)
+        return os.path.join(self.path, f"{base}.{generation}{ext}")
+
+    def _remove_stale_generations(self):
+        # Left behind by a replaced generation still mapped elsewhere, or by an interrupted build
+        live = {os.path.basename(self._file(name)) for name in GENERATION_FILES}
+        for file_name in os.listdir(self.path):
+            base, ext = os.path.splitext(file_name)
+            stem, _, generation = base.rpartition('.')
+            is_generation_file = file_name in GENERATION_FILES or (
+                generation.isdigit() and stem + ext in GENERATION_FILES)
+            if is_generation_file and file_name not in live:
+                try:
+                    os.remove(os.path.join(self.path, file_name))
+                except OSError:
+                    pass
+
+    def _map(self, file_path, dtype, shape):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(file_path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(file_path, dtype=dtype, mode='r+', shape=shape)
+
+    def _map_rows(self, capacity, generation=None):
+        vectors = self._map(self._file('vectors.bin', generation), self.dtype, (capacity, self.dim))
+        lists = self._map(self._file('lists.bin', generation), np.int32, (capacity,))
+        scales = None
+        if self.dtype == np.int8:
+            scales = self._map(self._file('scales.bin', generation), np.float32, (capacity,))
+        return vectors, lists, scales
+
+    def _write_metadata(self, metadata, meta_path):
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for entry in metadata:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, meta_path)
+
+    def _save_info(self):
+        info = {'dim': self.dim, 'dtype': self.dtype.name, 'count': self.count, 'capacity': self.capacity,
+                'next_id': self.next_id, 'clustered': self.clustered, 'generation': self.generation,
+                'scaled': True}
+        tmp_path = os.path.join(self.path, 'index.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, os.path.join(self.path, 'index.json'))
+
+    def _grow(self, needed):
+        # Called with the lock held; Windows refuses to resize a file that is still mapped
+        while self.readers:
+            self.readers_done.wait()
+        if needed <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        self.vectors.flush()
+        self.lists.flush()
+        if self.scales is not None:
+            self.scales.flush()
+        del self.vectors, self.lists, self.scales
+        self.capacity = capacity
+        self.vectors, self.lists, self.scales = self._map_rows(capacity)
+
+    def _normalize(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _encode(self, vectors):
+        """Return (encoded rows, per-row scales or None)"""
+        if self.dtype == np.int8:
+            peak = np.maximum(np.abs(vectors).max(axis=1), 1e-12)
+            encoded = np.round(vectors * (INT8_MAX / peak)[:, None]).astype(np.int8)
+            return encoded, (peak / INT8_MAX).astype(np.float32)
+        return vectors.astype(np.float16), None
+
+    def _decode(self, encoded, scales):
+        vectors = np.asarray(encoded, dtype=np.float32)
+        if scales is not None:
+            vectors *= np.asarray(scales, dtype=np.float32)[:, None]
+        return vectors
+
+    @staticmethod
+    def _scores(vectors, scales, rows, query):
+        scores = vectors[rows].astype(np.float32) @ query
+        if scales is not None:
+            scores *= scales[rows]
+        return scores
+
+    def _assign(self, vectors):
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def add(self, vectors, metadata):
+        """Append feature vectors with one metadata dict each; returns the new ids"""
+        vectors = self._normalize(vectors)
+        if len(vectors) != len(metadata):
+            raise ValueError("Expected one metadata entry per vector")
+        encoded, scales = self._encode(vectors)
+
+        with self.lock:
+            # _grow can wait (releasing the lock), so re-check until there is room
+            while self.count + len(vectors) > self.capacity:
+                self._grow(self.count + len(vectors))
+            start = self.count
+            end = start + len(vectors)
+
+            self.vectors[start:end] = encoded
+            self.lists[start:end] = self._assign(vectors)
+            self.vectors.flush()
+            self.lists.flush()
+            if scales is not None:
+                self.scales[start:end] = scales
+                self.scales.flush()
+
+            entries = []
+            for meta in metadata:
+                entry = dict(meta)
+                entry['id'] = self.next_id
+                entry.setdefault('added', time.time())
+                self.next_id += 1
+                entries.append(entry)
+            with open(self._file('meta.jsonl'), 'a') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + '\n')
+
+            self.metadata.extend(entries)
+            self.count = end
+            self._save_info()
+        return [entry['id'] for entry in entries]
+
+    def search(self, vector, k=5, n_probe=8):
+        """Return up to k (similarity, metadata) pairs, most similar first"""
+        query = self._normalize(vector)[0]
+        # Rows below count never change, so a snapshot can be scored without blocking appends
+        with self.lock:
+            view = (self.count, self.clustered, self.centroids, self.offsets,
+                    self.vectors, self.lists, self.scales, self.metadata)
+            self.readers += 1
+        try:
+            return self._search(query, k, n_probe, view)
+        finally:
+            with self.lock:
+                self.readers -= 1
+                self.readers_done.notify_all()
+
+    def _search(self, query, k, n_probe, view):
+        count, clustered, centroids, offsets, vectors, lists, scales, metadata = view
+        if count == 0 or k <= 0:
+            return []
+
+        rows, scores = [], []
+        if centroids is not None:
+            probe = np.argsort(centroids @ query)[::-1][:n_probe]
+            for p in probe:
+                begin, end = offsets[p], offsets[p + 1]
+                rows.append(np.arange(begin, end))
+                scores.append(self._scores(vectors, scales, slice(begin, end), query))
+            # Rows appended since the last build are not grouped yet
+            tail = clustered + np.flatnonzero(np.isin(lists[clustered:count], probe))
+            rows.append(tail)
+            scores.append(self._scores(vectors, scales, tail, query))
+        else:
+            for begin in range(0, count, SEARCH_CHUNK):
+                end = min(begin + SEARCH_CHUNK, count)
+                rows.append(np.arange(begin, end))
+                scores.append(self._scores(vectors, scales, slice(begin, end), query))
+        rows = np.concatenate(rows)
+        scores = np.concatenate(scores)
+
+        if len(scores) == 0:
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), metadata[int(rows[i])]) for i in top]
+
+    def vote(self, vector, k=5, n_probe=8):
+        """Similarity-weighted kNN vote over labelled neighbours; None if there are none"""
+        # Over-fetch so unlabelled neighbours (past uploads) don't starve the vote
+        neighbours = [(score, meta) for score, meta in self.search(vector, k * 4, n_probe)
+                      if meta.get('label') is not None][:k]
+        if not neighbours:
+            return None
+
+        weights = {}
+        for score, meta in neighbours:
+            weights[meta['label']] = weights.get(meta['label'], 0.0) + max(score, 0.0)
+        total = sum(weights.values())
+        label = max(weights, key=weights.get)
+        return {
+            'result': int(label),
+            'confidence': round(weights[label] / total, 3) if total > 0 else 0.0,
+            'k': len(neighbours)
+        }
+
+    def needs_rebuild(self, min_rows=IVF_MIN_ROWS, max_unclustered=MAX_UNCLUSTERED):
+        """True when the index is big enough to cluster and too much of it is unclustered"""
+        if self.build_lock.locked() or self.count < min_rows:
+            return False
+        return self.count - self.clustered > max_unclustered * self.clustered
+
+    def _read(self, rows):
+        # Copy rows out under the lock so appends and grows never race the builder
+        with self.lock:
+            return self._decode(self.vectors[rows], self.scales[rows] if self.scales is not None else None)
+
+    def build_ivf(self, n_lists=None, iterations=10, sample_size=50000, seed=42, blocking=True):
+        """Cluster the rows with spherical k-means and switch to a copy grouped by cluster
+
+        The clustering and the rewrite go to a new generation of files while
+        searches and appends keep using the current one; only the final catch-up
+        of rows appended in the meantime and the switch itself hold the lock.
+        Returns False if another build is already running and blocking is off.
+        """
+        if not self.build_lock.acquire(blocking=blocking):
+            return False
+
+        try:
+            with self.lock:
+                count = self.count
+                capacity = self.capacity
+                metadata = self.metadata[:count]
+                generation = self.generation + 1
+
+            n_lists = n_lists or max(1, int(4 * np.sqrt(count)))
+            if count < n_lists:
+                raise ValueError(f"Need at least {n_lists} vectors to build {n_lists} lists, have {count}")
+
+            rng = np.random.default_rng(seed)
+            sample_rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+            sample = self._read(sample_rows)
+
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                order = np.argsort(assignment, kind='stable')
+                sizes = np.bincount(assignment, minlength=n_lists)
+                starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+                # Empty clusters keep their previous centroid
+                sums = centroids.copy()
+                filled = sizes > 0
+                sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+                centroids = self._normalize(sums)
+            centroids = centroids.astype(np.float32)
+
+            lists = np.concatenate([
+                np.argmax(self._read(slice(start, min(start + SEARCH_CHUNK, count))) @ centroids.T, axis=1)
+                for start in range(0, count, SEARCH_CHUNK)
+            ]).astype(np.int32)
+            order = np.argsort(lists, kind='stable')
+            offsets = np.searchsorted(lists[order], np.arange(n_lists + 1)).astype(np.int64)
+
+            vectors, new_lists, scales = self._map_rows(capacity, generation)
+            for start in range(0, count, SEARCH_CHUNK):
+                rows = order[start:start + SEARCH_CHUNK]
+                with self.lock:
+                    vectors[start:start + len(rows)] = self.vectors[rows]
+                    if scales is not None:
+                        scales[start:start + len(rows)] = self.scales[rows]
+                new_lists[start:start + len(rows)] = lists[rows]
+            metadata = [metadata[i] for i in order]
+
+            with self.lock:
+                if self.capacity > capacity:
+                    for rows_map in (vectors, new_lists, scales):
+                        if rows_map is not None:
+                            rows_map.flush()
+                    del vectors, new_lists, scales, rows_map
+                    vectors, new_lists, scales = self._map_rows(self.capacity, generation)
+
+                # Rows appended while clustering stay in the unclustered tail
+                if self.count > count:
+                    tail = self.vectors[count:self.count]
+                    tail_scales = self.scales[count:self.count] if scales is not None else None
+                    vectors[count:self.count] = tail
+                    if scales is not None:
+                        scales[count:self.count] = tail_scales
+                    new_lists[count:self.count] = np.argmax(self._decode(tail, tail_scales) @ centroids.T, axis=1)
+                    metadata.extend(self.metadata[count:self.count])
+                for rows_map in (vectors, new_lists, scales):
+                    if rows_map is not None:
+                        rows_map.flush()
+                self._write_metadata(metadata, self._file('meta.jsonl', generation))
+                np.savez(self._file('ivf.npz', generation), centroids=centroids, offsets=offsets)
+
+                del self.vectors, self.lists, self.scales
+                self.vectors, self.lists, self.scales = vectors, new_lists, scales
+                self.metadata = metadata
+                self.centroids, self.offsets = centroids, offsets
+                self.clustered = count
+                self.generation = generation
+                # index.json names the live generation, so this is the commit point
+                self._save_info()
+
+            # Searches still scoring the old maps keep them alive; on Windows their files
+            # can't be removed yet and are cleaned up the next time the index is opened
+            self._remove_stale_generations()
+            return True
+        finally:
+            self.build_lock.release()
+
+
+def import_dataset(index, csv_path, source='training'):
+    """Add the deep features and labels from a feature extraction dataset.csv"""
+    with open(csv_path, newline='') as f:
+        reader = csv.DictReader(f)
+        deep_columns = [c for c in reader.fieldnames if c.startswith('deep_')]
+        vectors, metadata = [], []
+        for row in reader:
+            vectors.append([float(row[c]) for c in deep_columns])
+            metadata.append({'image': row.get('file_name'), 'label': int(row['label']), 'source': source})
+    if vectors:
+        index.add(np.array(vectors, dtype=np.float32), metadata)
+    return len(vectors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the Shroomify similar-scan index (with the API stopped)")
+    parser.add_argument('--index', default=os.getenv('FEATURE_INDEX_DIR', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'feature_index')), help="Index directory")
+    parser.add_argument('--dtype', choices=['int8', 'float16'], default='int8',
+                        help="Storage type when creating a new index (default: int8)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="Import a dataset.csv with deep_* feature columns")
+    import_parser.add_argument('csv_path')
+    import_parser.add_argument('--source', default='training')
+
+    ivf_parser = subparsers.add_parser('build-ivf', help="Cluster the index for faster search")
+    ivf_parser.add_argument('--lists', type=int, default=None,
+                            help="Number of clusters (default: 4 * sqrt(index size))")
+
+    subparsers.add_parser('info', help="Show index size")
+
+    args = parser.parse_args(argv)
+    try:
+        index = FeatureIndex(args.index, dtype=args.dtype)
+    except RuntimeError as e:
+        parser.exit(1, f"{e}\n")
+
+    try:
+        if args.command == 'import':
+            added = import_dataset(index, args.csv_path, args.source)
+            print(f"Imported {added} vectors; index now holds {len(index)}")
+        elif args.command == 'build-ivf':
+            index.build_ivf(args.lists)
+            print(f"Built {len(index.centroids)} lists over {len(index)} vectors")
+        else:
+            layout = f"IVF with {len(index.centroids)} lists" if index.centroids is not None else "brute force"
+            print(f"{len(index)} vectors ({index.dtype.name}, dim {index.dim}), {layout}, "
+                  f"{len(index) - index.clustered} unclustered")
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
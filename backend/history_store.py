@@ -0,0 +1,209 @@
+"""
+SQLite-backed scan history
+
+Scan rows are indexed on (email, date_logged, id) and paged with a keyset
+cursor, so a page costs the same no matter how deep into a user's history it
+is. Thumbnails and full images live in their own tables: list queries only
+ever touch the small rows and thumbnails, and the full image is fetched one
+scan at a time.
+"""
+import base64
+import io
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from PIL import Image
+
+THUMBNAIL_SIZE = (160, 160)
+THUMBNAIL_QUALITY = 70
+MAX_PAGE_SIZE = 100
+DELETE_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    date_logged TEXT NOT NULL,
+    detected_disease INTEGER,
+    confidence REAL,
+    model_version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_scans_email_date ON scans (email, date_logged DESC, id DESC);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    scan_id INTEGER PRIMARY KEY REFERENCES scans (id) ON DELETE CASCADE,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    scan_id INTEGER PRIMARY KEY REFERENCES scans (id) ON DELETE CASCADE,
+    data BLOB NOT NULL,
+    mime TEXT NOT NULL
+);
+"""
+
+
+def normalize_email(email):
+    # Stored lower-case so lookups are exact matches on the index, not ILIKE scans
+    return email.strip().lower()
+
+
+def normalize_date(value=None):
+    """Return a UTC timestamp string whose lexicographic order is chronological"""
+    if value is None:
+        moment = datetime.now(timezone.utc)
+    else:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def encode_cursor(date_logged, scan_id):
+    return base64.urlsafe_b64encode(json.dumps([date_logged, scan_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        date_logged, scan_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(date_logged), int(scan_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def make_thumbnail(image_bytes):
+    try:
+        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    except Exception:
+        # PIL raises UnidentifiedImageError (an OSError) for bytes that aren't an image
+        raise ValueError("Uploaded file is not a valid image")
+    image.thumbnail(THUMBNAIL_SIZE)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def image_mime(image_bytes):
+    try:
+        image_format = Image.open(io.BytesIO(image_bytes)).format
+    except Exception:
+        return 'application/octet-stream'
+    return Image.MIME.get(image_format, 'application/octet-stream')
+
+
+class HistoryStore:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # One connection per thread; the Flask dev server handles requests on many
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA foreign_keys=ON')
+            self.local.conn = conn
+        return conn
+
+    def add(self, email, image_bytes, detected_disease, confidence, date_logged=None, model_version=None):
+        """Store a scan with its full image and a JPEG thumbnail; returns the scan id"""
+        thumbnail = make_thumbnail(image_bytes)
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO scans (email, date_logged, detected_disease, confidence, model_version) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (normalize_email(email), normalize_date(date_logged), detected_disease, confidence, model_version)
+            )
+            scan_id = cursor.lastrowid
+            conn.execute('INSERT INTO thumbnails (scan_id, data) VALUES (?, ?)', (scan_id, thumbnail))
+            conn.execute('INSERT INTO images (scan_id, data, mime) VALUES (?, ?, ?)',
+                         (scan_id, image_bytes, image_mime(image_bytes)))
+        return scan_id
+
+    def _filters(self, email, detected_disease=None, since=None):
+        """WHERE clauses and parameters shared by list and count"""
+        clauses = ['s.email = ?']
+        params = [normalize_email(email)]
+        if detected_disease is not None:
+            clauses.append('s.detected_disease = ?')
+            params.append(int(detected_disease))
+        if since:
+            clauses.append('s.date_logged >= ?')
+            params.append(normalize_date(since))
+        return clauses, params
+
+    def list(self, email, limit=25, cursor=None, detected_disease=None, since=None, include_thumbnails=True):
+        """Return one page of a user's scans, newest first, and the cursor for the next page"""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses, params = self._filters(email, detected_disease, since)
+
+        if cursor:
+            date_logged, scan_id = decode_cursor(cursor)
+            clauses.append('(s.date_logged, s.id) < (?, ?)')
+            params.extend([date_logged, scan_id])
+
+        thumbnail_column = ', t.data AS thumbnail' if include_thumbnails else ''
+        thumbnail_join = 'LEFT JOIN thumbnails t ON t.scan_id = s.id' if include_thumbnails else ''
+        rows = self._connect().execute(
+            f'SELECT s.id, s.email, s.date_logged, s.detected_disease, s.confidence, s.model_version'
+            f'{thumbnail_column} FROM scans s {thumbnail_join} '
+            f'WHERE {" AND ".join(clauses)} ORDER BY s.date_logged DESC, s.id DESC LIMIT ?',
+            params + [limit + 1]
+        ).fetchall()
+
+        items = []
+        for row in rows[:limit]:
+            item = {key: row[key] for key in ('id', 'email', 'date_logged', 'detected_disease',
+                                              'confidence', 'model_version')}
+            if include_thumbnails:
+                item['thumbnail'] = base64.b64encode(row['thumbnail']).decode() if row['thumbnail'] else None
+            items.append(item)
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(last['date_logged'], last['id'])
+        return items, next_cursor
+
+    def count(self, email, detected_disease=None, since=None):
+        """Number of the user's scans matching the same filters as list"""
+        clauses, params = self._filters(email, detected_disease, since)
+        row = self._connect().execute(f'SELECT COUNT(*) FROM scans s WHERE {" AND ".join(clauses)}',
+                                      params).fetchone()
+        return row[0]
+
+    def exists(self, email, date_logged):
+        """True if the user already has a scan logged at exactly this time"""
+        row = self._connect().execute('SELECT 1 FROM scans WHERE email = ? AND date_logged = ? LIMIT 1',
+                                      (normalize_email(email), normalize_date(date_logged))).fetchone()
+        return row is not None
+
+    def get_image(self, email, scan_id):
+        """Return (bytes, mime) for one of the user's scans, or None"""
+        row = self._connect().execute(
+            'SELECT i.data, i.mime FROM images i JOIN scans s ON s.id = i.scan_id '
+            'WHERE s.id = ? AND s.email = ?',
+            (int(scan_id), normalize_email(email))
+        ).fetchone()
+        return (row['data'], row['mime']) if row else None
+
+    def delete(self, email, scan_ids):
+        """Delete the given scans (and their images) owned by the user; returns how many went"""
+        email = normalize_email(email)
+        scan_ids = [int(scan_id) for scan_id in scan_ids]
+        deleted = 0
+        conn = self._connect()
+        with conn:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(scan_ids), DELETE_CHUNK):
+                chunk = scan_ids[start:start + DELETE_CHUNK]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor = conn.execute(f'DELETE FROM scans WHERE email = ? AND id IN ({placeholders})',
+                                      [email] + chunk)
+                deleted += cursor.rowcount
+        return deleted
@@ -0,0 +1,45 @@
+"""
+Image helpers shared by the API and the batch scorer
+
+Kept free of torch and Flask so batch_score worker processes can import them
+without building the CNN or the app, which the spawn start method (the default
+on Windows and macOS) would otherwise do once per worker.
+"""
+import numpy as np
+from PIL import Image
+from skimage.color import rgb2gray
+from skimage.feature import graycomatrix, graycoprops
+
+# Allowed file extensions
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'gif'}
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+class GLCMFeatureExtractor:
+    def __init__(self, distances=[50], angles=[np.pi/2], levels=256, props=None):
+        self.distances = distances
+        self.angles = angles
+        self.levels = levels
+        self.props = props or ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation']
+        self.feature_names = [f"{prop.capitalize()}" for prop in self.props]
+
+    def extract_from_image(self, image_path):
+        image = self._load_image(image_path)
+        glcm = graycomatrix(image, 
+                            distances=self.distances,
+                            angles=self.angles,
+                            levels=self.levels)
+        
+        features = {}
+        for prop in self.props:
+            value = graycoprops(glcm, prop)[0, 0]
+            features[prop.capitalize()] = value
+        
+        return features
+
+    def _load_image(self, image_path):
+        im_frame = Image.open(image_path).convert("RGB")
+        gray_image = rgb2gray(np.array(im_frame))
+        return (gray_image * 255).astype(np.uint8)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+One-off import of the Supabase "Logs" table into the local scan history
+
+Copies every existing Logs row (image, detected_disease, confidence,
+date_logged) into the SQLite store that /api/history serves, so users keep
+their past scans after the History tab moves to the backend:
+
+    python import_logs.py
+    python import_logs.py --db history.db --page-size 200
+
+Rows are read in id order through the Supabase REST API, so an interrupted
+import can simply be re-run; scans already present for the same user and
+timestamp are skipped. Reading other users' rows needs a key that can see
+them (SUPABASE_SERVICE_ROLE_KEY, falling back to the anon key).
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import sys
+import urllib.parse
+import urllib.request
+
+from history_store import HistoryStore
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COLUMNS = 'id,email,date_logged,detected_disease,confidence,image'
+
+logger = logging.getLogger('import_logs')
+
+
+def decode_image(value):
+    """Return image bytes from a Logs.image value, or None
+
+    bytea comes back from PostgREST as a \\x-prefixed hex string. The frontend
+    inserted Uint8Arrays, which supabase-js serialised as {"0": 255, ...}
+    JSON, so the decoded bytes are usually that JSON rather than the image.
+    """
+    if not value:
+        return None
+    if value.startswith('\\x'):
+        data = bytes.fromhex(value[2:])
+    else:
+        data = base64.b64decode(value.split(',', 1)[-1])
+
+    if data.startswith(b'{'):
+        try:
+            values = json.loads(data)
+            return bytes(values[str(i)] for i in range(len(values)))
+        except (ValueError, KeyError, TypeError):
+            return None
+    return data
+
+
+def fetch_page(url, key, after_id, page_size):
+    query = urllib.parse.urlencode({
+        'select': COLUMNS,
+        'id': f'gt.{after_id}',
+        'order': 'id.asc',
+        'limit': page_size
+    })
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/rest/v1/Logs?{query}",
+        headers={'apikey': key, 'Authorization': f'Bearer {key}'}
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.load(response)
+
+
+def run(url, key, store, page_size=200):
+    """Import every Logs row; returns (imported, skipped)"""
+    imported = skipped = 0
+    after_id = 0
+    while True:
+        rows = fetch_page(url, key, after_id, page_size)
+        if not rows:
+            break
+        for row in rows:
+            after_id = row['id']
+            image = decode_image(row.get('image'))
+            if not row.get('email') or not row.get('date_logged') or image is None:
+                logger.warning(f"Skipping Logs row {row['id']}: missing email, date or image")
+                skipped += 1
+                continue
+            if store.exists(row['email'], row['date_logged']):
+                skipped += 1
+                continue
+            try:
+                store.add(row['email'], image, row.get('detected_disease'), row.get('confidence'),
+                          date_logged=row['date_logged'])
+                imported += 1
+            except ValueError as e:
+                logger.warning(f"Skipping Logs row {row['id']}: {e}")
+                skipped += 1
+        logger.info(f"Imported {imported} scans so far (last Logs id {after_id})")
+    return imported, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import Supabase Logs rows into the local scan history")
+    parser.add_argument('--db', default=os.getenv('HISTORY_DB_PATH', os.path.join(BASE_DIR, 'history.db')),
+                        help="Scan history database (default: HISTORY_DB_PATH or backend/history.db)")
+    parser.add_argument('--page-size', type=int, default=200, help="Rows fetched per request (default: 200)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    url = os.getenv('SUPABASE_URL', os.getenv('NEXT_PUBLIC_SUPABASE_URL'))
+    key = os.getenv('SUPABASE_SERVICE_ROLE_KEY', os.getenv('SUPABASE_ANON_KEY', os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY')))
+    if not url or not key:
+        logger.error("Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (or SUPABASE_ANON_KEY)")
+        return 1
+
+    try:
+        imported, skipped = run(url, key, HistoryStore(args.db), args.page_size)
+    except Exception as e:
+        logger.error(f"Import failed: {e}")
+        return 1
+    logger.info(f"Finished: imported {imported} scans, skipped {skipped}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Cross-validated ANN training and hyperparameter sweep
+
+Script version of ANN.ipynb for retraining after each data drop:
+
+    python train_ann.py dataset.csv --output-dir ../backend
+    python train_ann.py dataset.csv --hidden1 128,256,512 --dropout 0.2,0.3,0.5 --lr 1e-3,3e-4
+
+dataset.csv is parsed once and cached as .npy files next to it, which the
+worker processes memory-map instead of re-reading the CSV. Every combination of
+hidden sizes, dropout and learning rate is scored with stratified k-fold CV and
+early stopping on validation loss. The best configuration is then retrained on
+the full dataset for its mean best epoch count, and ann_model_state_dict.pth and
+minmax_scaler.pkl are written in the format the backend's load_models reads.
+"""
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import MinMaxScaler
+
+GLCM_FEATURES = ["Contrast", "Dissimilarity", "Homogeneity", "Energy", "Correlation"]
+
+
+class ANN(nn.Module):
+    # Layer names must match ANN in backend/app.py so the state dict loads there
+    def __init__(self, input_size=517, hidden1=256, hidden2=128, num_classes=3, dropout=0.3):
+        super(ANN, self).__init__()
+        self.fc1 = nn.Linear(input_size, hidden1)
+        self.relu1 = nn.ReLU()
+        self.dropout1 = nn.Dropout(dropout)
+        self.fc2 = nn.Linear(hidden1, hidden2)
+        self.relu2 = nn.ReLU()
+        self.dropout2 = nn.Dropout(dropout)
+        self.output = nn.Linear(hidden2, num_classes)
+
+    def forward(self, x):
+        x = self.dropout1(self.relu1(self.fc1(x)))
+        x = self.dropout2(self.relu2(self.fc2(x)))
+        return self.output(x)
+
+
+def load_dataset(csv_path):
+    """Return memory-mapped (features, labels), converting the CSV only when it changed"""
+    base = os.path.splitext(csv_path)[0]
+    features_path, labels_path = f"{base}.features.npy", f"{base}.labels.npy"
+
+    csv_mtime = os.path.getmtime(csv_path)
+    if not all(os.path.exists(p) and os.path.getmtime(p) >= csv_mtime for p in (features_path, labels_path)):
+        with open(csv_path, newline='') as f:
+            reader = csv.DictReader(f)
+            resnet_features = [c for c in reader.fieldnames if c.startswith('deep_')]
+            feature_cols = GLCM_FEATURES + resnet_features
+            features, labels = [], []
+            for row in reader:
+                features.append([float(row[c]) for c in feature_cols])
+                labels.append(int(row['label']))
+        # Write then rename so an interrupted conversion is never mistaken for a cache
+        for path, array in ((features_path, np.array(features, dtype=np.float32)),
+                            (labels_path, np.array(labels, dtype=np.int64))):
+            tmp_path = f"{path}.tmp.npy"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+
+    return np.load(features_path, mmap_mode='r'), np.load(labels_path, mmap_mode='r')
+
+
+def train_model(config, X_train, y_train, X_val=None, y_val=None, num_classes=3, epochs=500, patience=20, seed=42):
+    """Full-batch Adam as in ANN.ipynb; with validation data, stop early and keep the best state"""
+    torch.manual_seed(seed)
+    model = ANN(X_train.shape[1], config['hidden1'], config['hidden2'], num_classes, config['dropout'])
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=config['lr'])
+
+    X_train_tensor = torch.tensor(X_train, dtype=torch.float32)
+    y_train_tensor = torch.tensor(y_train, dtype=torch.long)
+    if X_val is not None:
+        X_val_tensor = torch.tensor(X_val, dtype=torch.float32)
+        y_val_tensor = torch.tensor(y_val, dtype=torch.long)
+
+    best = {'loss': float('inf'), 'accuracy': 0.0, 'epoch': epochs, 'state': None}
+    for epoch in range(1, epochs + 1):
+        model.train()
+        optimizer.zero_grad()
+        loss = criterion(model(X_train_tensor), y_train_tensor)
+        loss.backward()
+        optimizer.step()
+
+        if X_val is None:
+            continue
+
+        model.eval()
+        with torch.no_grad():
+            val_outputs = model(X_val_tensor)
+            val_loss = criterion(val_outputs, y_val_tensor).item()
+        if val_loss < best['loss']:
+            accuracy = (val_outputs.argmax(dim=1) == y_val_tensor).float().mean().item()
+            best = {'loss': val_loss, 'accuracy': accuracy, 'epoch': epoch,
+                    'state': {k: v.clone() for k, v in model.state_dict().items()}}
+        elif epoch - best['epoch'] >= patience:
+            break
+
+    if best['state'] is not None:
+        model.load_state_dict(best['state'])
+    model.eval()
+    return model, best
+
+
+def evaluate_fold(task):
+    """Train one (config, fold) pair; runs in a worker process"""
+    config, train_idx, val_idx, csv_path, args = task
+    # Each worker trains its own model; let the pool provide the parallelism
+    torch.set_num_threads(1)
+
+    X, y = load_dataset(csv_path)
+    scaler = MinMaxScaler()
+    X_train = scaler.fit_transform(X[train_idx])
+    X_val = scaler.transform(X[val_idx])
+
+    _, best = train_model(config, X_train, y[train_idx], X_val, y[val_idx], **args)
+    return {'loss': best['loss'], 'accuracy': best['accuracy'], 'epoch': best['epoch']}
+
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(',') if v.strip()]
+
+
+def save_atomic(save, obj, path):
+    # The backend can watch these files; never let it see a half-written one
+    tmp_path = f"{path}.tmp"
+    save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-validated ANN hyperparameter sweep")
+    parser.add_argument('dataset', help="dataset.csv from the feature extraction notebook")
+    parser.add_argument('--output-dir', default='.', help="Where to write the model and scaler (default: .)")
+    parser.add_argument('--hidden1', default='256', help="Comma-separated first hidden layer sizes")
+    parser.add_argument('--hidden2', default='128', help="Comma-separated second hidden layer sizes")
+    parser.add_argument('--dropout', default='0.3', help="Comma-separated dropout rates")
+    parser.add_argument('--lr', default='0.001', help="Comma-separated Adam learning rates")
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--epochs', type=int, default=500, help="Maximum epochs per run")
+    parser.add_argument('--patience', type=int, default=20, help="Epochs without val loss improvement before stopping")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    X, y = load_dataset(args.dataset)
+    print(f"Loaded {len(y)} samples with {X.shape[1]} features")
+
+    configs = [
+        {'hidden1': h1, 'hidden2': h2, 'dropout': d, 'lr': lr}
+        for h1, h2, d, lr in itertools.product(parse_list(args.hidden1, int), parse_list(args.hidden2, int),
+                                               parse_list(args.dropout, float), parse_list(args.lr, float))
+    ]
+    folds = list(StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=args.seed).split(X, y))
+    num_classes = int(y.max()) + 1
+    train_args = {'num_classes': num_classes, 'epochs': args.epochs, 'patience': args.patience, 'seed': args.seed}
+    tasks = [(config, train_idx, val_idx, args.dataset, train_args)
+             for config in configs for train_idx, val_idx in folds]
+    print(f"Evaluating {len(configs)} configurations x {args.folds} folds")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        fold_results = list(pool.map(evaluate_fold, tasks))
+
+    results = []
+    for i, config in enumerate(configs):
+        runs = fold_results[i * args.folds:(i + 1) * args.folds]
+        results.append(dict(
+            config,
+            val_loss=float(np.mean([r['loss'] for r in runs])),
+            val_accuracy=float(np.mean([r['accuracy'] for r in runs])),
+            val_accuracy_std=float(np.std([r['accuracy'] for r in runs])),
+            best_epoch=int(round(np.mean([r['epoch'] for r in runs])))
+        ))
+    results.sort(key=lambda r: r['val_loss'])
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, 'sweep_results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+
+    for r in results[:5]:
+        print(f"hidden=({r['hidden1']}, {r['hidden2']}) dropout={r['dropout']} lr={r['lr']}: "
+              f"val_loss={r['val_loss']:.4f} val_acc={r['val_accuracy']:.3f}±{r['val_accuracy_std']:.3f} "
+              f"epochs={r['best_epoch']}")
+
+    # Refit on all data for the epoch count early stopping settled on across folds
+    best = results[0]
+    scaler = MinMaxScaler()
+    X_all = scaler.fit_transform(X)
+    model, _ = train_model(best, X_all, np.asarray(y), num_classes=num_classes,
+                           epochs=best['best_epoch'], seed=args.seed)
+
+    save_atomic(joblib.dump, scaler, os.path.join(args.output_dir, 'minmax_scaler.pkl'))
+    save_atomic(torch.save, model.state_dict(), os.path.join(args.output_dir, 'ann_model_state_dict.pth'))
+    print(f"Saved best model and scaler to {args.output_dir} in {time.time() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
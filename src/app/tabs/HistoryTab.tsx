@@ -3,6 +3,7 @@ import { Calendar, Clock, AlertTriangle, CheckCircle, Eye, Trash2, Search, Downl
 import React, { useState, useMemo, useCallback, useEffect } from 'react';
 import { supabase } from '../../lib/supabaseClient';
 import { useAuth } from '../../lib/AuthContext';
+import { deleteHistory, fetchHistoryImage, fetchHistoryPage, getAccessToken, HistoryItem, HistoryQuery } from '../../lib/historyApi';
 import ImageEnlargementModal from './ImageEnlargementModal';
 
 // Types for better type safety and scalability
@@ -43,9 +44,45 @@ const CONFIG = {
     MEDIUM: 75,
     LOW: 60
   },
-  EXPORT_FORMATS: ['csv', 'json', 'pdf'] as const
+  EXPORT_FORMATS: ['csv', 'json', 'pdf'] as const,
+  // Scans fetched per request from the backend history API
+  API_PAGE_SIZE: 50
 };
 
+const DISEASE_BY_STATUS: Record<FilterOptions['status'], number | null> = {
+  all: null,
+  healthy: 0,
+  green_mold: 1,
+  black_mold: 2
+};
+
+// Start of the selected date range as an ISO timestamp, or null for all time
+const dateRangeStart = (dateRange: FilterOptions['dateRange']): string | null => {
+  if (dateRange === 'all') return null;
+  const cutoffDate = new Date();
+  switch (dateRange) {
+    case 'today':
+      cutoffDate.setHours(0, 0, 0, 0);
+      break;
+    case 'week':
+      cutoffDate.setDate(cutoffDate.getDate() - 7);
+      break;
+    case 'month':
+      cutoffDate.setMonth(cutoffDate.getMonth() - 1);
+      break;
+  }
+  return cutoffDate.toISOString();
+};
+
+const toHistoryLog = (item: HistoryItem): HistoryLog => ({
+  id: item.id,
+  date_logged: item.date_logged,
+  image: item.thumbnail ? `data:image/jpeg;base64,${item.thumbnail}` : null,
+  detected_disease: item.detected_disease,
+  email: item.email,
+  confidence: item.confidence
+});
+
 const HistoryTab = () => {
   const { user } = useAuth();
   
@@ -77,8 +114,19 @@ const HistoryTab = () => {
     direction: 'desc'
   });
   const [enlargedImage, setEnlargedImage] = useState<{ src: string; title: string } | null>(null);
-
-  // Fetch history logs from Supabase
+  // Backend history is used whenever the user has a Supabase Auth session
+  const [accessToken, setAccessToken] = useState<string | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+
+  // Status and date filters are applied by the backend so only matching pages are sent
+  const serverQuery = useMemo((): HistoryQuery => ({
+    limit: CONFIG.API_PAGE_SIZE,
+    detectedDisease: DISEASE_BY_STATUS[filters.status],
+    since: dateRangeStart(filters.dateRange)
+  }), [filters.status, filters.dateRange]);
+
+  // Fetch the first page of history from the backend, or the Supabase Logs table as a fallback
   const fetchHistoryLogs = useCallback(async () => {
     console.log('fetchHistoryLogs called, user:', user);
     console.log('user email:', user?.email);
@@ -93,6 +141,17 @@ const HistoryTab = () => {
     setError(null);
 
     try {
+      const token = await getAccessToken();
+      setAccessToken(token);
+      if (token) {
+        const page = await fetchHistoryPage(token, serverQuery);
+        setHistoryLogs(page.items.map(toHistoryLog));
+        setNextCursor(page.next_cursor);
+        return;
+      }
+      setNextCursor(null);
+
+      // Email/password accounts have no access token for the backend; read Supabase Logs directly
       console.log('Querying Supabase for email:', user.email);
       
       // First, let's check if the table exists and what data is in it
@@ -191,7 +250,47 @@ const HistoryTab = () => {
     } finally {
       setIsLoading(false);
     }
-  }, [user]);
+  }, [user, serverQuery]);
+
+  // Append the next cursor page of backend history
+  const loadMoreHistory = useCallback(async () => {
+    if (!accessToken || !nextCursor) return;
+
+    setIsLoadingMore(true);
+    try {
+      const page = await fetchHistoryPage(accessToken, { ...serverQuery, cursor: nextCursor });
+      setHistoryLogs(prev => [...prev, ...page.items.map(toHistoryLog)]);
+      setNextCursor(page.next_cursor);
+    } catch (err) {
+      console.error('Error loading more history:', err);
+      setError(`Failed to load more history: ${err instanceof Error ? err.message : 'Unknown error'}`);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  }, [accessToken, nextCursor, serverQuery]);
+
+  // Show the full-size image; backend thumbnails are only 160px
+  const openEnlargedImage = useCallback(async (log: ProcessedHistoryLog, thumbnailSrc: string, title: string) => {
+    if (!accessToken) {
+      setEnlargedImage({ src: thumbnailSrc, title });
+      return;
+    }
+    try {
+      setEnlargedImage({ src: await fetchHistoryImage(accessToken, log.id), title });
+    } catch (err) {
+      console.error('Error loading full-size image:', err);
+      setEnlargedImage({ src: thumbnailSrc, title });
+    }
+  }, [accessToken]);
+
+  const closeEnlargedImage = useCallback(() => {
+    setEnlargedImage(prev => {
+      if (prev?.src.startsWith('blob:')) {
+        URL.revokeObjectURL(prev.src);
+      }
+      return null;
+    });
+  }, []);
 
   // Fetch data when component mounts or user changes
   useEffect(() => {
@@ -380,12 +479,17 @@ const HistoryTab = () => {
     setIsLoading(true);
     try {
       console.log('Attempting to delete log with ID:', showDeleteConfirm.logId);
-      
-      // Try with quotes first
-      let { error: deleteError } = await supabase
-        .from('"Logs"')
-        .delete()
-        .eq('id', showDeleteConfirm.logId);
+
+      let deleteError = null;
+      if (accessToken) {
+        await deleteHistory(accessToken, [showDeleteConfirm.logId]);
+      } else {
+        // Try with quotes first
+        ({ error: deleteError } = await supabase
+          .from('"Logs"')
+          .delete()
+          .eq('id', showDeleteConfirm.logId));
+      }
 
       // If that fails, try without quotes
       if (deleteError) {
@@ -412,7 +516,7 @@ const HistoryTab = () => {
     } finally {
       setIsLoading(false);
     }
-  }, [showDeleteConfirm.logId, fetchHistoryLogs]);
+  }, [showDeleteConfirm.logId, fetchHistoryLogs, accessToken]);
 
   const cancelDeleteLog = useCallback(() => {
     setShowDeleteConfirm({ show: false, logId: null });
@@ -435,12 +539,17 @@ const HistoryTab = () => {
       // Convert string IDs back to numbers for the database
       const numericIds = showBulkDeleteConfirm.logIds.map(id => parseInt(id));
       console.log('Attempting to delete logs with IDs:', numericIds);
-      
-      // Try with quotes first
-      let { error: deleteError } = await supabase
-        .from('"Logs"')
-        .delete()
-        .in('id', numericIds);
+
+      let deleteError = null;
+      if (accessToken) {
+        await deleteHistory(accessToken, numericIds);
+      } else {
+        // Try with quotes first
+        ({ error: deleteError } = await supabase
+          .from('"Logs"')
+          .delete()
+          .in('id', numericIds));
+      }
 
       // If that fails, try without quotes
       if (deleteError) {
@@ -468,7 +577,7 @@ const HistoryTab = () => {
     } finally {
       setIsLoading(false);
     }
-  }, [showBulkDeleteConfirm.logIds, fetchHistoryLogs]);
+  }, [showBulkDeleteConfirm.logIds, fetchHistoryLogs, accessToken]);
 
   const cancelBulkDelete = useCallback(() => {
     setShowBulkDeleteConfirm({ show: false, logIds: [] });
@@ -996,10 +1105,7 @@ const HistoryTab = () => {
                         const imageSrc = getImageSrc(log.image, log.id);
                         console.log('Image clicked, src:', imageSrc);
                         if (imageSrc) {
-                          setEnlargedImage({
-                            src: imageSrc,
-                            title: `Scan #${log.chronologicalNumber} - ${getStatusText(log.detected_disease)}`
-                          });
+                          openEnlargedImage(log, imageSrc, `Scan #${log.chronologicalNumber} - ${getStatusText(log.detected_disease)}`);
                         }
                       }}
                     >
@@ -1064,6 +1170,18 @@ const HistoryTab = () => {
         )}
       </div>
 
+      {nextCursor && (
+        <div className="flex justify-center">
+          <button
+            onClick={loadMoreHistory}
+            disabled={isLoadingMore}
+            className="bg-gray-700 hover:bg-gray-600 text-white px-4 py-2 rounded-lg text-sm transition-colors disabled:opacity-50 disabled:cursor-not-allowed"
+          >
+            {isLoadingMore ? 'Loading...' : 'Load older scans'}
+          </button>
+        </div>
+      )}
+
       {/* Pagination */}
       {totalPages > 1 && (
         <div className="flex flex-col sm:flex-row items-center justify-between space-y-4 sm:space-y-0">
@@ -1203,7 +1321,7 @@ const HistoryTab = () => {
       {/* Image Enlargement Modal */}
       <ImageEnlargementModal
         isOpen={enlargedImage !== null}
-        onClose={() => setEnlargedImage(null)}
+        onClose={closeEnlargedImage}
         imageSrc={enlargedImage?.src || ''}
         title={enlargedImage?.title || 'Image Preview'}
         alt="Enlarged scan image"
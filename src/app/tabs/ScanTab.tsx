@@ -5,6 +5,7 @@ import Webcam from 'react-webcam';
 import ErrorModal from "@/app/tabs/ErrorModal";
 import { useAuth } from "@/lib/AuthContext";
 import { supabase } from "@/lib/supabaseClient";
+import { API_BASE, addHistoryScan, authHeaders, getAccessToken } from "@/lib/historyApi";
 import ImageEnlargementModal from './ImageEnlargementModal';
 
 // Interface for scan data stored in localStorage
@@ -374,8 +375,8 @@ const ScanTab = () => {
   const [scanMode, setScanMode] = useState<'individual' | 'batch'>('individual');
   const [showQueueModal, setShowQueueModal] = useState(false);
   const [queueItems, setQueueItems] = useState<{ id: string; image: string }[]>([]);
-  const [healthyImages, setHealthyImages] = useState<{ image: string; prediction: number; confidence: number }[]>([]);
-  const [contaminatedImages, setContaminatedImages] = useState<{ image: string; prediction: number; confidence: number }[]>([]);
+  const [healthyImages, setHealthyImages] = useState<{ image: string; prediction: number; confidence: number; historyId?: number | null }[]>([]);
+  const [contaminatedImages, setContaminatedImages] = useState<{ image: string; prediction: number; confidence: number; historyId?: number | null }[]>([]);
   const [contaminatedFilter, setContaminatedFilter] = useState<'all' | 'green' | 'black'>('all');
   const [enlargedQueueImage, setEnlargedQueueImage] = useState<string | null>(null);
   const [toastMessage, setToastMessage] = useState<string | null>(null);
@@ -385,6 +386,8 @@ const ScanTab = () => {
   const [scanResult, setScanResult] = useState<number | string | null>(null);
   const [previewImage, setPreviewImage] = useState<string | null>(null);
   const [confidence, setConfidence] = useState<number | null>(null);
+  // Set when /api/upload already recorded the scan in the backend history
+  const [historyId, setHistoryId] = useState<number | null>(null);
   const [showError, setShowError] = useState(false);
   const [isSaving, setIsSaving] = useState(false);
   const [saveMessage, setSaveMessage] = useState<string | null>(null);
@@ -453,6 +456,46 @@ const ScanTab = () => {
     }
   };
 
+  // Store one scan in the user's history; returns false if it could not be stored
+  const storeScan = async (
+    scan: { date_logged: string; detected_disease: number; email: string; confidence: number; image: string },
+    uploadedHistoryId?: number | null
+  ) => {
+    // Uploads sent with an access token are already in the backend history
+    if (uploadedHistoryId != null) {
+      return true;
+    }
+
+    const token = await getAccessToken();
+    if (token) {
+      await addHistoryScan(token, scan.image, scan.detected_disease, scan.confidence, scan.date_logged);
+      return true;
+    }
+
+    // Email/password accounts have no Supabase Auth session, so they still write to Logs
+    const binaryString = atob(scan.image);
+    const bytes = new Uint8Array(binaryString.length);
+    for (let i = 0; i < binaryString.length; i++) {
+      bytes[i] = binaryString.charCodeAt(i);
+    }
+
+    const { error } = await supabase
+      .from('Logs')
+      .insert({
+        date_logged: scan.date_logged,
+        image: bytes,
+        detected_disease: scan.detected_disease,
+        email: scan.email,
+        confidence: scan.confidence
+      });
+
+    if (error) {
+      console.error('Error saving scan to database:', error);
+      return false;
+    }
+    return true;
+  };
+
   // Function to sync localStorage data to database
   const syncToDatabase = async () => {
     setIsSyncing(true);
@@ -472,25 +515,7 @@ const ScanTab = () => {
       let syncedCount = 0;
       for (const scan of unsyncedScans) {
         try {
-          // Convert base64 image to binary data for bytea storage
-          const binaryString = atob(scan.image);
-          const bytes = new Uint8Array(binaryString.length);
-          for (let i = 0; i < binaryString.length; i++) {
-            bytes[i] = binaryString.charCodeAt(i);
-          }
-
-          const { error } = await supabase
-            .from('Logs')
-            .insert({
-              date_logged: scan.date_logged,
-              image: bytes,
-              detected_disease: scan.detected_disease,
-              email: scan.email,
-              confidence: scan.confidence
-            });
-
-          if (error) {
-            console.error('Error syncing scan to database:', error);
+          if (!(await storeScan(scan))) {
             // Don't mark as synced if there was an error
             continue;
           }
@@ -547,23 +572,7 @@ const ScanTab = () => {
           
           // Try to sync to database
           try {
-            const binaryString = atob(item.image);
-            const bytes = new Uint8Array(binaryString.length);
-            for (let i = 0; i < binaryString.length; i++) {
-              bytes[i] = binaryString.charCodeAt(i);
-            }
-
-            const { error } = await supabase
-              .from('Logs')
-              .insert({
-                date_logged: savedData.date_logged,
-                image: bytes,
-                detected_disease: item.prediction,
-                email: user.email,
-                confidence: item.confidence
-              });
-
-            if (!error) {
+            if (await storeScan(savedData, item.historyId)) {
               // Mark as synced in localStorage
               const scans = JSON.parse(localStorage.getItem('shroomify_scans') || '[]');
               const updatedScans = scans.map((scan: ScanData) => 
@@ -622,36 +631,12 @@ const ScanTab = () => {
       
       // Step 2: Try to sync to database (may fail, but that's okay)
       try {
-        // Convert base64 image to binary data for bytea storage
-        const binaryString = atob(image);
-        const bytes = new Uint8Array(binaryString.length);
-        for (let i = 0; i < binaryString.length; i++) {
-          bytes[i] = binaryString.charCodeAt(i);
-        }
-        
         console.log('Attempting to sync to database...');
 
-        const { data, error } = await supabase
-          .from('Logs')
-          .insert({
-            date_logged: savedData.date_logged,
-            image: bytes,
-            detected_disease: result,
-            email: email,
-            confidence: confidence
-          });
-
-        if (error) {
-          console.error('Database sync failed:', error);
-          console.error('Error details:', {
-            message: error.message,
-            details: error.details,
-            hint: error.hint,
-            code: error.code
-          });
+        if (!(await storeScan(savedData, historyId))) {
           setSaveMessage('Saving . . .');
         } else {
-          console.log('Successfully synced to database:', data);
+          console.log('Successfully synced to database');
           // Mark as synced in localStorage
           const scans = JSON.parse(localStorage.getItem('shroomify_scans') || '[]');
           const updatedScans = scans.map((scan: ScanData) => 
@@ -699,13 +684,13 @@ const ScanTab = () => {
     return { id, base64 };
   };
 
-  const completeBatchItem = (id: string, outcome: 'healthy' | 'contaminated' | 'unknown', image: string, prediction?: number, confidence?: number) => {
+  const completeBatchItem = (id: string, outcome: 'healthy' | 'contaminated' | 'unknown', image: string, prediction?: number, confidence?: number, historyId?: number | null) => {
     setQueueItems((prev) => prev.filter((item) => item.id !== id));
     const defaultConfidence = confidence ?? 0.8;
     if (outcome === 'healthy') {
-      setHealthyImages((prev) => [{ image, prediction: prediction ?? 0, confidence: defaultConfidence }, ...prev]);
+      setHealthyImages((prev) => [{ image, prediction: prediction ?? 0, confidence: defaultConfidence, historyId }, ...prev]);
     } else if (outcome === 'contaminated') {
-      setContaminatedImages((prev) => [{ image, prediction: prediction ?? 1, confidence: defaultConfidence }, ...prev]);
+      setContaminatedImages((prev) => [{ image, prediction: prediction ?? 1, confidence: defaultConfidence, historyId }, ...prev]);
     }
   };
 
@@ -744,8 +729,10 @@ const ScanTab = () => {
           const formData = new FormData();
           formData.append('image', blob, 'snapshot.jpg');
 
-          const response = await fetch('https://reliably-one-kiwi.ngrok-free.app/api/upload', {
+          const response = await fetch(`${API_BASE}/api/upload`, {
             method: 'POST',
+            // Lets the backend record the scan in the signed-in user's history
+            headers: await authHeaders(),
             body: formData,
           });
 
@@ -756,7 +743,7 @@ const ScanTab = () => {
           const prediction = result.prediction ?? result.result;
           const confidence = result.confidence ?? 0.8;
           const outcome = prediction === 0 ? 'healthy' : 'contaminated';
-          completeBatchItem(id, outcome, processedImage, prediction, confidence);
+          completeBatchItem(id, outcome, processedImage, prediction, confidence, result.history_id);
         } catch (error) {
           console.error('Scan failed (batch):', error);
           completeBatchItem(id, 'unknown', base64);
@@ -778,8 +765,10 @@ const ScanTab = () => {
         formData.append('image', blob, 'snapshot.jpg');
 
         // Send to backend
-        const response = await fetch('https://reliably-one-kiwi.ngrok-free.app/api/upload', {
+        const response = await fetch(`${API_BASE}/api/upload`, {
           method: 'POST',
+          // Lets the backend record the scan in the signed-in user's history
+          headers: await authHeaders(),
           body: formData,
         });
 
@@ -791,6 +780,7 @@ const ScanTab = () => {
           setScanResult('no_fruiting_bag'); // Special case for no fruiting bag
           setPreviewImage(result.image || null);
           setConfidence(null);
+          setHistoryId(null);
           setIsSaved(false);
           setShowResult(true);
           return;
@@ -800,6 +790,7 @@ const ScanTab = () => {
         setScanResult(result.prediction ?? result.result);
         setPreviewImage(result.image);
         setConfidence(result.confidence);
+        setHistoryId(result.history_id ?? null);
         setIsSaved(false);
         setShowResult(true);
 
@@ -841,8 +832,10 @@ const ScanTab = () => {
             const formData = new FormData();
             formData.append('image', file);
 
-            const response = await fetch('https://reliably-one-kiwi.ngrok-free.app/api/upload', {
+            const response = await fetch(`${API_BASE}/api/upload`, {
               method: 'POST',
+              // Lets the backend record the scan in the signed-in user's history
+              headers: await authHeaders(),
               body: formData,
             });
 
@@ -853,7 +846,7 @@ const ScanTab = () => {
             const prediction = result.prediction ?? result.result;
             const confidence = result.confidence ?? 0.8;
             const outcome = prediction === 0 ? 'healthy' : 'contaminated';
-            completeBatchItem(id, outcome, processedImage, prediction, confidence);
+            completeBatchItem(id, outcome, processedImage, prediction, confidence, result.history_id);
           } catch (err) {
             console.error('Upload failed (batch):', err);
             setShowError(true);
@@ -867,8 +860,10 @@ const ScanTab = () => {
 
         try {
           setIsScanning(true);
-          const response = await fetch('https://reliably-one-kiwi.ngrok-free.app/api/upload', {
+          const response = await fetch(`${API_BASE}/api/upload`, {
             method: 'POST',
+            // Lets the backend record the scan in the signed-in user's history
+            headers: await authHeaders(),
             body: formData,
           });
 
@@ -880,6 +875,7 @@ const ScanTab = () => {
             setScanResult('no_fruiting_bag'); // Special case for no fruiting bag
             setPreviewImage(result.image || null);
             setConfidence(null);
+            setHistoryId(null);
             setIsSaved(false);
             setShowResult(true);
             return;
@@ -888,6 +884,7 @@ const ScanTab = () => {
           setScanResult(result.prediction || result.result);
           setPreviewImage(result.image);
           setConfidence(result.confidence);
+          setHistoryId(result.history_id ?? null);
           setIsSaved(false);
           setShowResult(true);
           
@@ -0,0 +1,105 @@
+"use client";
+
+import { supabase } from "./supabaseClient";
+
+export const API_BASE = process.env.NEXT_PUBLIC_NGROK_URL || "https://reliably-one-kiwi.ngrok-free.app";
+
+export interface HistoryItem {
+  id: number;
+  email: string;
+  date_logged: string;
+  detected_disease: number | null;
+  confidence: number | null;
+  model_version: string | null;
+  thumbnail: string | null; // base64 JPEG
+}
+
+export interface HistoryPage {
+  items: HistoryItem[];
+  next_cursor: string | null;
+  total?: number;
+}
+
+export interface HistoryQuery {
+  limit?: number;
+  cursor?: string | null;
+  detectedDisease?: number | null;
+  since?: string | null;
+}
+
+// The backend takes the user from a verified Supabase access token. Only accounts that
+// signed in through Supabase Auth (Google) have one; email/password accounts return null.
+export const getAccessToken = async (): Promise<string | null> => {
+  const { data } = await supabase.auth.getSession();
+  return data.session?.access_token ?? null;
+};
+
+export const authHeaders = async (): Promise<Record<string, string>> => {
+  const token = await getAccessToken();
+  return token ? { Authorization: `Bearer ${token}` } : {};
+};
+
+const checkResponse = async (response: Response) => {
+  if (!response.ok) {
+    const body = await response.json().catch(() => ({}));
+    throw new Error(body.error || `Request failed with status ${response.status}`);
+  }
+  return response;
+};
+
+export const fetchHistoryPage = async (token: string, query: HistoryQuery = {}): Promise<HistoryPage> => {
+  const params = new URLSearchParams({ limit: String(query.limit ?? 25) });
+  if (query.cursor) params.set("cursor", query.cursor);
+  if (query.detectedDisease != null) params.set("detected_disease", String(query.detectedDisease));
+  if (query.since) params.set("since", query.since);
+
+  const response = await fetch(`${API_BASE}/api/history?${params}`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  return (await checkResponse(response)).json();
+};
+
+// Returns an object URL for the full-size image; revoke it when done
+export const fetchHistoryImage = async (token: string, id: number): Promise<string> => {
+  const response = await fetch(`${API_BASE}/api/history/${id}/image`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  const blob = await (await checkResponse(response)).blob();
+  return URL.createObjectURL(blob);
+};
+
+export const deleteHistory = async (token: string, ids: number[]): Promise<number> => {
+  const response = await fetch(`${API_BASE}/api/history`, {
+    method: "DELETE",
+    headers: { Authorization: `Bearer ${token}`, "Content-Type": "application/json" },
+    body: JSON.stringify({ ids }),
+  });
+  return (await (await checkResponse(response)).json()).deleted;
+};
+
+export const addHistoryScan = async (
+  token: string,
+  imageBase64: string,
+  detectedDisease: number,
+  confidence: number,
+  dateLogged: string
+): Promise<number> => {
+  const binaryString = atob(imageBase64);
+  const bytes = new Uint8Array(binaryString.length);
+  for (let i = 0; i < binaryString.length; i++) {
+    bytes[i] = binaryString.charCodeAt(i);
+  }
+
+  const formData = new FormData();
+  formData.append("image", new Blob([bytes], { type: "image/jpeg" }), "scan.jpg");
+  formData.append("detected_disease", String(detectedDisease));
+  formData.append("confidence", String(confidence));
+  formData.append("date_logged", dateLogged);
+
+  const response = await fetch(`${API_BASE}/api/history`, {
+    method: "POST",
+    headers: { Authorization: `Bearer ${token}` },
+    body: formData,
+  });
+  return (await (await checkResponse(response)).json()).id;
+};